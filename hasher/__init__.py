@@ -2,5 +2,9 @@
 
 try:
     from hasher import Hasher
+    from hashstore import HashStore
+    from hashindex import BKTree, MultiIndexHash
 except ImportError:
     from .hasher import Hasher
+    from .hashstore import HashStore
+    from .hashindex import BKTree, MultiIndexHash
@@ -3,6 +3,8 @@
 from enum import Enum
 from PIL import Image, UnidentifiedImageError
 import imagehash
+import hashlib
+import numpy
 import math
 
 class Hasher:
@@ -100,6 +102,54 @@ class Hasher:
 
         return str(result)
 
+    @staticmethod
+    def hashImageAllMethods(image: Image, hashMethods: list = None, hash_size: int = 8) -> dict:
+        """
+        Hashes the image given using several hashing methods from a single decode and grayscale conversion.
+
+        Every method converts the image to grayscale before resizing it to its own size,
+        so the conversion is done once and shared. Results are the same as calling hashImage per method.
+
+        Parameters:
+        - image: accepts a filename or PIL image.
+        - hashMethods: a list of hash methods in the ImageHashMethod enum (or their raw values). Defaults to all methods.
+        - hash_size: the hash size passed to each method.
+
+        Returns:
+        A dictionary mapping the raw value of each hash method to its hash.
+        """
+        if isinstance(image, str):
+            image = Image.open(image)
+        if hashMethods is None:
+            hashMethods = list(Hasher.ImageHashMethod)
+
+        gray = image.convert('L')
+        hashes = {}
+        for hashMethod in hashMethods:
+            method = hashMethod.value if isinstance(hashMethod, Hasher.ImageHashMethod) else hashMethod
+            hashes[method] = Hasher.hashImage(gray, method, hash_size=hash_size)
+        return hashes
+
+    @staticmethod
+    def digestImage(image: Image) -> str:
+        """
+        Computes a fast digest of the decoded pixels of the image, such that identical images share the same digest
+        regardless of their filenames or file formats.
+
+        Parameters:
+        - image: accepts a filename or PIL image.
+        """
+        if isinstance(image, str):
+            image = Image.open(image)
+
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(('%s %d %d ' % (image.mode, image.size[0], image.size[1])).encode())
+        palette = image.getpalette() if image.mode in ('P', 'PA') else None
+        if palette:
+            digest.update(bytes(palette))
+        digest.update(image.tobytes())
+        return digest.hexdigest()
+
     @staticmethod
     def hashText(text: str, hashMethod: str = 'ENdist'):
         d = {}
@@ -170,3 +220,95 @@ class Hasher:
         else:
             raise ValueError('An unexpected hash type ' + str(hashType) + ' was given to compute the hash difference')
 
+    @staticmethod
+    def bitsForDiff(max_diff: float, bits: int) -> int:
+        """
+        Returns the largest number of differing bits whose normalised difference is still within max_diff, or -1 if none are.
+
+        This matches the floating point comparison diff(hash1, hash2, 'IMAGE') <= max_diff exactly.
+
+        Parameters:
+        - max_diff: the maximum normalised difference, e.g. 1 - img_sim_min.
+        - bits: the number of bits in each hash.
+        """
+        if max_diff < 0:
+            return -1
+        r = min(bits, int(max_diff*bits))
+        while r < bits and (r + 1)/bits <= max_diff:
+            r += 1
+        while r >= 0 and r/bits > max_diff:
+            r -= 1
+        return r
+
+    #number of set bits for every possible byte value, used for vectorised hamming distances
+    _POPCOUNT_TABLE = numpy.array([bin(x).count('1') for x in range(256)], dtype=numpy.uint8)
+
+    @staticmethod
+    def hashToBytes(hash1: str) -> bytes:
+        """
+        Converts an image hash hex string into its packed bytes representation.
+
+        Parameters:
+        - hash1: the image hash hex string, as returned by hashImage.
+        """
+        if isinstance(hash1, (bytes, bytearray)):
+            return bytes(hash1)
+        if len(hash1) % 2:
+            hash1 = '0' + hash1
+        return bytes.fromhex(hash1)
+
+    @staticmethod
+    def hashesToMatrix(hashes: list):
+        """
+        Packs a list of equal length image hash hex strings into a numpy uint8 matrix, one hash per row.
+
+        Parameters:
+        - hashes: a list of image hash hex strings, as returned by hashImage.
+        """
+        rows = [Hasher.hashToBytes(h) for h in hashes]
+        width = len(rows[0]) if rows else 0
+        if any(len(r) != width for r in rows):
+            raise ValueError('All hashes must be of the same length to be packed into a matrix')
+        return numpy.frombuffer(b''.join(rows), dtype=numpy.uint8).reshape((len(rows), width))
+
+    @staticmethod
+    def diffMany(target: str, matrix, bits: int = None):
+        """
+        Computes the differences between an image hash and every hash packed in the matrix at once.
+
+        This is equivalent to calling diff(target, h, 'IMAGE') for every row h, but uses a single vectorised popcount.
+
+        Parameters:
+        - target: the image hash hex string (or its packed bytes) to be compared.
+        - matrix: a numpy uint8 matrix of packed hashes, as returned by hashesToMatrix.
+        - bits: the number of bits the distances are normalised by. Defaults to 4 per hex digit of the target.
+
+        Returns:
+        A numpy float64 array of normalised hamming distances, one per row.
+        """
+        if bits is None:
+            bits = len(target)*4 if isinstance(target, str) else len(target)*8
+        target = numpy.frombuffer(Hasher.hashToBytes(target), dtype=numpy.uint8)
+        if matrix.ndim != 2 or matrix.shape[1] != target.shape[0]:
+            return numpy.ones(matrix.shape[0], dtype=numpy.float64)
+
+        counts = Hasher._POPCOUNT_TABLE[numpy.bitwise_xor(matrix, target)].sum(axis=1, dtype=numpy.int64)
+        return counts / bits
+
+    @staticmethod
+    def countBitDiffsMany(targets, matrix):
+        """
+        Counts the differing bits between every packed hash in targets and every packed hash in matrix.
+
+        Parameters:
+        - targets: a numpy uint8 matrix of packed hashes, as returned by hashesToMatrix.
+        - matrix: a numpy uint8 matrix of packed hashes of the same width.
+
+        Returns:
+        A numpy uint16 matrix with one row per target and one column per row of matrix.
+        """
+        if targets.shape[1] != matrix.shape[1]:
+            raise ValueError('All hashes must be of the same length to be compared as matrices')
+        xor = numpy.bitwise_xor(targets[:, None, :], matrix[None, :, :])
+        return Hasher._POPCOUNT_TABLE[xor].sum(axis=2, dtype=numpy.uint16)
+
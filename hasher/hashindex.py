@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+
+import itertools
+import math
+try:
+    from hasher import Hasher
+except ImportError:
+    from .hasher import Hasher
+
+class BKTree:
+    """
+    Burkhard-Keller tree of named image hashes under the hamming distance.
+
+    Radius queries only visit subtrees whose edge distances can satisfy the triangle inequality,
+    so near-duplicate lookups touch a small fraction of the stored hashes.
+    Results are always returned in insertion order of their names.
+    """
+    def __init__(self, hashes: dict = None):
+        """
+        Initialises the tree, optionally from a dictionary mapping names to image hash hex strings.
+
+        Parameters:
+        - hashes: a dictionary mapping names to image hashes. Insertion order is retained.
+        """
+        self.__root = None
+        self.__hex_len = None
+        self.__nameToNode = {}
+        self.__order = {}
+        self.__counter = 0
+        self.__others = {}
+
+        if hashes:
+            for name, value in hashes.items():
+                self.add(name, value)
+
+    def __len__(self):
+        return len(self.__order)
+
+    def __contains__(self, name):
+        return name in self.__order
+
+    def add(self, name: str, value: str):
+        """Adds or replaces the hash for the given name. Replacing an existing name keeps its position."""
+        if name in self.__order:
+            self.__detach(name)
+        else:
+            self.__order[name] = self.__counter
+            self.__counter += 1
+
+        if self.__hex_len is None:
+            self.__hex_len = len(value)
+        if len(value) != self.__hex_len:
+            self.__others[name] = value
+            return
+
+        key = int(value, 16)
+        if self.__root is None:
+            self.__root = [key, set(), {}]
+        node = self.__root
+        while True:
+            dist = bin(node[0] ^ key).count('1')
+            if dist == 0:
+                break
+            child = node[2].get(dist)
+            if child is None:
+                child = [key, set(), {}]
+                node[2][dist] = child
+                node = child
+                break
+            node = child
+
+        node[1].add(name)
+        self.__nameToNode[name] = node
+
+    def remove(self, name: str):
+        """Removes the hash for the given name, if present. Emptied nodes are retained for routing."""
+        if name in self.__order:
+            self.__detach(name)
+            del self.__order[name]
+
+    def query(self, target: str, max_diff: float) -> list:
+        """
+        Finds every stored hash whose normalised difference to the target is at most max_diff.
+
+        Returns:
+        A list of (name, difference) tuples in insertion order, with differences equivalent to Hasher.diff with the IMAGE type.
+        """
+        results = []
+        if self.__root is not None and len(target) == self.__hex_len:
+            bits = self.__hex_len*4
+            radius = Hasher.bitsForDiff(max_diff, bits)
+            key = int(target, 16)
+            stack = [self.__root] if radius >= 0 else []
+            while stack:
+                node = stack.pop()
+                dist = bin(node[0] ^ key).count('1')
+                if dist <= radius:
+                    for name in node[1]:
+                        results.append((name, dist/bits))
+                for edge, child in node[2].items():
+                    if dist - radius <= edge <= dist + radius:
+                        stack.append(child)
+        elif 1.0 <= max_diff:
+            #hashes of differing lengths are considered completely different
+            for name, node in self.__nameToNode.items():
+                results.append((name, 1.0))
+
+        for name, value in self.__others.items():
+            diff = Hasher.diff(value, target, Hasher.Type.IMAGE)
+            if diff <= max_diff:
+                results.append((name, diff))
+
+        results.sort(key=lambda x: self.__order[x[0]])
+        return results
+
+    def __detach(self, name):
+        node = self.__nameToNode.pop(name, None)
+        if node is not None:
+            node[1].discard(name)
+        self.__others.pop(name, None)
+
+class MultiIndexHash:
+    """
+    Multi-index hashing of named image hashes under the hamming distance.
+
+    Each hash is split into disjoint chunks with one table per chunk keyed by the chunk value.
+    By the pigeonhole principle, any hash within a radius r of the target differs by at most r // chunks bits
+    in at least one chunk, so only the table entries within that smaller radius need to be looked up.
+    Candidates are then verified against the full hash, so results are exact.
+    Results are always returned in insertion order of their names.
+    """
+    def __init__(self, hashes: dict = None, chunks: int = 8):
+        """
+        Initialises the index, optionally from a dictionary mapping names to image hash hex strings.
+
+        Parameters:
+        - hashes: a dictionary mapping names to image hashes. Insertion order is retained.
+        - chunks: the number of disjoint chunks each hash is split into.
+        """
+        self.__chunks = chunks
+        self.__hex_len = None
+        self.__spans = []
+        self.__tables = []
+        self.__nameToKey = {}
+        self.__order = {}
+        self.__counter = 0
+        self.__others = {}
+
+        if hashes:
+            for name, value in hashes.items():
+                self.add(name, value)
+
+    def __len__(self):
+        return len(self.__order)
+
+    def __contains__(self, name):
+        return name in self.__order
+
+    def add(self, name: str, value: str):
+        """Adds or replaces the hash for the given name. Replacing an existing name keeps its position."""
+        if name in self.__order:
+            self.__detach(name)
+        else:
+            self.__order[name] = self.__counter
+            self.__counter += 1
+
+        if self.__hex_len is None:
+            self.__setUp(len(value))
+        if len(value) != self.__hex_len:
+            self.__others[name] = value
+            return
+
+        key = int(value, 16)
+        for table, chunk in zip(self.__tables, self.__split(key)):
+            if chunk not in table:
+                table[chunk] = set()
+            table[chunk].add(name)
+        self.__nameToKey[name] = key
+
+    def remove(self, name: str):
+        """Removes the hash for the given name, if present."""
+        if name in self.__order:
+            self.__detach(name)
+            del self.__order[name]
+
+    def query(self, target: str, max_diff: float) -> list:
+        """
+        Finds every stored hash whose normalised difference to the target is at most max_diff.
+
+        Returns:
+        A list of (name, difference) tuples in insertion order, with differences equivalent to Hasher.diff with the IMAGE type.
+        """
+        results = []
+        if self.__hex_len is not None and len(target) == self.__hex_len:
+            bits = self.__hex_len*4
+            radius = Hasher.bitsForDiff(max_diff, bits)
+            key = int(target, 16)
+            if radius >= 0:
+                sub_radius = radius // len(self.__spans)
+                candidates = set()
+                for (_, width), table, chunk in zip(self.__spans, self.__tables, self.__split(key)):
+                    for neighbour in self.__neighbours(chunk, width, sub_radius, table):
+                        candidates.update(table.get(neighbour, ()))
+
+                for name in candidates:
+                    dist = bin(self.__nameToKey[name] ^ key).count('1')
+                    if dist <= radius:
+                        results.append((name, dist/bits))
+        elif 1.0 <= max_diff:
+            #hashes of differing lengths are considered completely different
+            for name in self.__nameToKey:
+                results.append((name, 1.0))
+
+        for name, value in self.__others.items():
+            diff = Hasher.diff(value, target, Hasher.Type.IMAGE)
+            if diff <= max_diff:
+                results.append((name, diff))
+
+        results.sort(key=lambda x: self.__order[x[0]])
+        return results
+
+    def __setUp(self, hex_len):
+        self.__hex_len = hex_len
+        bits = hex_len*4
+        chunks = max(1, min(self.__chunks, bits))
+        offset = 0
+        for i in range(chunks):
+            width = bits//chunks + (1 if i < bits % chunks else 0)
+            self.__spans.append((offset, width))
+            offset += width
+        self.__tables = [{} for _ in self.__spans]
+
+    def __split(self, key):
+        return [(key >> offset) & ((1 << width) - 1) for offset, width in self.__spans]
+
+    @staticmethod
+    def __neighbours(chunk, width, radius, table):
+        """Yields every chunk value within the radius of the given chunk value which may be in the table."""
+        count = sum(math.comb(width, k) for k in range(min(radius, width) + 1))
+        if count > len(table):
+            for value in table:
+                if bin(value ^ chunk).count('1') <= radius:
+                    yield value
+            return
+        for k in range(min(radius, width) + 1):
+            for positions in itertools.combinations(range(width), k):
+                flipped = chunk
+                for p in positions:
+                    flipped ^= 1 << p
+                yield flipped
+
+    def __detach(self, name):
+        key = self.__nameToKey.pop(name, None)
+        if key is not None:
+            for table, chunk in zip(self.__tables, self.__split(key)):
+                table[chunk].discard(name)
+                if not table[chunk]:
+                    del table[chunk]
+        self.__others.pop(name, None)
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+
+import numpy
+try:
+    from hasher import Hasher
+except ImportError:
+    from .hasher import Hasher
+
+class HashStore:
+    """
+    Array-backed store of named image hashes.
+
+    Hashes are packed into a numpy uint8 matrix (one row per image, in insertion order)
+    so that a target hash can be compared against the whole store at once via Hasher.diffMany.
+    Rows are appended with amortised O(1) growth and removed rows are compacted lazily.
+    """
+    def __init__(self, hashes: dict = None):
+        """
+        Initialises the store, optionally from a dictionary mapping names to image hash hex strings.
+
+        Parameters:
+        - hashes: a dictionary mapping names to image hashes. Insertion order is retained.
+        """
+        self.__names = []
+        self.__rows = {}
+        self.__hex_len = None
+        self.__matrix = numpy.zeros((0, 0), dtype=numpy.uint8)
+        self.__alive = numpy.zeros(0, dtype=bool)
+        self.__size = 0
+        self.__removed = 0
+        self.__mismatched = {}
+
+        if hashes:
+            for name, value in hashes.items():
+                self.add(name, value)
+
+    @staticmethod
+    def fromMatrix(names, matrix, hex_len: int, mismatched: dict = None):
+        """
+        Creates a store from an already packed hash matrix, without parsing any hex strings.
+
+        The matrix and names are used in place, e.g. a read-only view of a memory mapped file,
+        and are only copied once the store is changed. Names are only looked up by row until then,
+        so a lazily decoded sequence of names is only decoded for the rows which are returned.
+
+        Parameters:
+        - names: the names of the rows of the matrix, in order. Any sequence is accepted.
+        - matrix: a numpy uint8 matrix of packed hashes, as returned by Hasher.hashesToMatrix.
+        - hex_len: the length of the hex strings the hashes of the matrix were packed from.
+        - mismatched: a dictionary mapping rows to hashes of other lengths, which are left as zeros in the matrix.
+        """
+        store = HashStore()
+        if not len(names):
+            return store
+        store.__hex_len = hex_len
+        store.__matrix = matrix
+        store.__alive = None
+        store.__size = len(names)
+        store.__names = names
+        store.__rows = None
+        store.__mismatched = dict(mismatched or {})
+        return store
+
+    def __getRows(self) -> dict:
+        """returns the dictionary mapping names to rows, building it if the store was created from a matrix"""
+        if self.__rows is None:
+            self.__rows = {name: i for i, name in enumerate(self.__names)}
+        return self.__rows
+
+    def __own(self):
+        """copies a matrix and names the store was created with, before the store is changed"""
+        if self.__alive is None:
+            self.__getRows()
+            self.__matrix = numpy.array(self.__matrix, dtype=numpy.uint8)
+            self.__names = list(self.__names)
+            self.__alive = numpy.ones(self.__size, dtype=bool)
+
+    def __len__(self):
+        return self.__size - self.__removed
+
+    def __contains__(self, name):
+        return name in self.__getRows()
+
+    def __getitem__(self, name):
+        row = self.__getRows()[name]
+        if row in self.__mismatched:
+            return self.__mismatched[row]
+        return self.__matrix[row].tobytes().hex()[-self.__hex_len:]
+
+    def getBits(self) -> int:
+        """Returns the number of bits in each hash of this store, or None if it is empty."""
+        return None if self.__hex_len is None else self.__hex_len*4
+
+    def getNames(self) -> list:
+        """Returns the names of all hashes in the store, in insertion order."""
+        self.__compact()
+        return list(self.__names)
+
+    def getRow(self, name: str) -> int:
+        """Returns the row of the given name in getMatrix. Raises KeyError if it isn't in the store."""
+        self.__compact()
+        return self.__getRows()[name]
+
+    def getName(self, row: int) -> str:
+        """Returns the name of the given row of getMatrix."""
+        self.__compact()
+        return self.__names[row]
+
+    def getMatrix(self):
+        """Returns the packed hash matrix of the store, one row per name as per getNames."""
+        self.__compact()
+        return self.__matrix[:self.__size]
+
+    def getMismatched(self) -> dict:
+        """Returns a dictionary mapping rows of getMatrix to hashes which do not fit into the matrix, which are left as zeros there."""
+        self.__compact()
+        return dict(self.__mismatched)
+
+    def add(self, name: str, value: str):
+        """
+        Adds or replaces the hash for the given name.
+
+        Replacing an existing name keeps its position, similar to assigning to a dictionary.
+        """
+        if self.__hex_len is None:
+            self.__hex_len = len(value)
+            self.__matrix = numpy.zeros((16, len(Hasher.hashToBytes(value))), dtype=numpy.uint8)
+            self.__alive = numpy.zeros(16, dtype=bool)
+        self.__own()
+
+        row = self.__rows.get(name)
+        if row is None:
+            if self.__size == self.__matrix.shape[0]:
+                self.__grow()
+            row = self.__size
+            self.__size += 1
+            self.__names.append(name)
+            self.__rows[name] = row
+            self.__alive[row] = True
+
+        self.__mismatched.pop(row, None)
+        if len(value) == self.__hex_len:
+            self.__matrix[row] = numpy.frombuffer(Hasher.hashToBytes(value), dtype=numpy.uint8)
+        else:
+            #rarely, a hash may not fit into the matrix. it's compared separately instead.
+            self.__matrix[row] = 0
+            self.__mismatched[row] = value
+
+    def remove(self, name: str):
+        """Removes the hash for the given name, if present."""
+        if name not in self.__getRows():
+            return
+        self.__own()
+        row = self.__rows.pop(name)
+        if row is None:
+            return
+        self.__alive[row] = False
+        self.__mismatched.pop(row, None)
+        self.__removed += 1
+        if self.__removed > len(self.__rows):
+            self.__compact()
+
+    def __diffRows(self, target: str):
+        """returns the normalised hamming distances between the target hash and every row, including removed ones"""
+        if len(target) == self.__hex_len:
+            distances = Hasher.diffMany(target, self.__matrix[:self.__size], bits=self.__hex_len*4)
+        else:
+            distances = numpy.ones(self.__size, dtype=numpy.float64)
+
+        for row, value in self.__mismatched.items():
+            distances[row] = Hasher.diff(value, target, Hasher.Type.IMAGE)
+        return distances
+
+    def diff(self, target: str):
+        """
+        Computes the difference between the target hash and every hash in the store.
+
+        Returns:
+        A tuple of the list of names and a numpy array of their respective
+        normalised hamming distances, equivalent to Hasher.diff with the IMAGE type.
+        """
+        self.__compact()
+        if self.__hex_len is None:
+            return ([], numpy.zeros(0, dtype=numpy.float64))
+        return (list(self.__names), self.__diffRows(target))
+
+    def query(self, target: str, max_diff: float) -> list:
+        """
+        Finds every stored hash whose normalised difference to the target is at most max_diff, via a linear scan,
+        as per the query method of the image hash indexes. Only the names of the rows found are looked up.
+
+        Returns:
+        A list of (name, difference) tuples in insertion order, with differences equivalent to Hasher.diff with the IMAGE type.
+        """
+        self.__compact()
+        if self.__hex_len is None:
+            return []
+        distances = self.__diffRows(target)
+        rows = numpy.flatnonzero(distances <= max_diff)
+        return [(self.__names[row], distances[row].item()) for row in rows.tolist()]
+
+    def __grow(self):
+        capacity = max(16, self.__matrix.shape[0]*2)
+        matrix = numpy.zeros((capacity, self.__matrix.shape[1]), dtype=numpy.uint8)
+        matrix[:self.__size] = self.__matrix[:self.__size]
+        alive = numpy.zeros(capacity, dtype=bool)
+        alive[:self.__size] = self.__alive[:self.__size]
+        self.__matrix = matrix
+        self.__alive = alive
+
+    def __compact(self):
+        """Drops removed rows while retaining the order of the remaining rows."""
+        if self.__removed == 0:
+            return
+        keep = numpy.flatnonzero(self.__alive[:self.__size])
+        mismatched = {}
+        for new_row, old_row in enumerate(keep.tolist()):
+            if old_row in self.__mismatched:
+                mismatched[new_row] = self.__mismatched[old_row]
+        names = [self.__names[i] for i in keep.tolist()]
+
+        self.__matrix[:len(keep)] = self.__matrix[keep]
+        self.__alive[:] = False
+        self.__alive[:len(keep)] = True
+        self.__size = len(keep)
+        self.__names = names
+        self.__rows = {name: i for i, name in enumerate(names)}
+        self.__mismatched = mismatched
+        self.__removed = 0
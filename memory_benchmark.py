@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+'''
+Measures the memory used per RedditPost, RedditComment and OCR.TextGroup object,
+compared to equivalent objects keeping the same attributes in a per-instance __dict__ (as before they were slotted).
+'''
+
+import gc
+import sys
+import tracemalloc
+
+from reddit.redditpost import RedditPost, RedditComment
+from ocr.ocr import OCR
+
+def slotNames(cls) -> list:
+    '''returns the attribute names of all slots of the class and its bases, as mangled names'''
+    names = []
+    for c in cls.__mro__:
+        for slot in c.__dict__.get('__slots__', ()):
+            if slot == '__weakref__':
+                continue
+            names.append('_' + c.__name__.lstrip('_') + slot if slot.startswith('__') else slot)
+    return names
+
+def measure(factory, count: int) -> float:
+    '''returns the average number of bytes allocated per object made by the factory'''
+    gc.collect()
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    objects = [factory(i) for i in range(count)]
+    size = tracemalloc.get_traced_memory()[0] - start
+    tracemalloc.stop()
+    del objects
+    return size/count
+
+def compare(name: str, template, count: int):
+    '''prints the memory per object of copies of the template, slotted and unslotted, sharing all attribute values'''
+    cls = type(template)
+    names = slotNames(cls)
+    values = {n: getattr(template, n) for n in names}
+    #a plain class per slotted class, so its instances share their __dict__ keys as instances of the class would
+    unslotted_cls = type('Unslotted' + cls.__name__, (), {})
+
+    def slotted(i):
+        obj = object.__new__(cls)
+        for n, v in values.items():
+            setattr(obj, n, v)
+        return obj
+
+    def unslotted(i):
+        obj = unslotted_cls()
+        for n, v in values.items():
+            setattr(obj, n, v)
+        return obj
+
+    before = measure(unslotted, count)
+    after = measure(slotted, count)
+    print('%-14s %3d attributes  %7.1f bytes with __dict__  %7.1f bytes slotted  (%.0f%% saved)' % \
+          (name, len(names), before, after, 100*(1 - after/before)))
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    print('memory per object, averaged over %d objects (attribute values are shared, so only the objects are measured):' % count)
+
+    post = RedditPost.fromJson({'kind': 't3', 'data': {'id': 'abc123', 'subreddit': 'memes', 'permalink': '/r/memes/comments/abc123/slug/',
+                                                      'title': 'title', 'author': 'author', 'score': 1, 'post_hint': 'image',
+                                                      'url': 'https://i.redd.it/abc123.png'}})
+    comment = RedditComment.fromJson({'kind': 't1', 'data': {'id': 'def456', 'permalink': '/r/memes/comments/abc123/slug/def456/',
+                                                            'author': 'author', 'body': 'text', 'score': 1}})
+    group = OCR.TextGroup(10, 20, 30, 12, 'word')
+
+    compare('RedditPost', post, count)
+    compare('RedditComment', comment, count)
+    compare('TextGroup', group, count)
@@ -2,5 +2,7 @@
 
 try:
     from ocr import OCR
+    from ocrpool import OCRPool
 except ImportError:
     from .ocr import OCR
+    from .ocrpool import OCRPool
@@ -46,18 +46,54 @@ class OCR:
         if isinstance(meme, str):
             meme = Image.open(meme)
         if normalized:
-            x,y = list(meme.size)
-            scale_factor = 500/x
-            x *= scale_factor
-            y *= scale_factor
-
-            meme = meme.resize((int(x),int(y)), Image.ANTIALIAS)
+            meme = OCR.normalizedImage(meme)
 
         rawdata = pytesseract.image_to_data(meme, output_type=pytesseract.Output.DICT)
+        return OCR.textFromImageData(rawdata)
+
+    @staticmethod
+    def normalizedImage(meme):
+        '''Returns the image resized to the standard width of 500 pixels used for normalized reading, retaining its aspect ratio.'''
+        x,y = list(meme.size)
+        scale_factor = 500/x
+        x *= scale_factor
+        y *= scale_factor
+
+        return meme.resize((int(x),int(y)), Image.ANTIALIAS)
+
+    @staticmethod
+    def textFromImageData(rawdata):
+        '''Returns the text read by read2 from pytesseract.image_to_data dict output (or its formatted form), with words grouped and groups sorted from top to bottom.'''
         groups = OCR.getTextGroups(rawdata)
         groups.sort(key=lambda x: x.getTop())
         return '\n\n'.join(list(map(lambda x: x.getText(), groups)))
 
+    @staticmethod
+    def parseImageDataTsv(tsv: str):
+        '''
+        Parses tesseract's TSV output into the same dict format as pytesseract.image_to_data with pytesseract.Output.DICT.
+
+        The header row is optional, as the TSV output of tesseract's API omits it.
+        '''
+        header = ['level', 'page_num', 'block_num', 'par_num', 'line_num', 'word_num',
+                  'left', 'top', 'width', 'height', 'conf', 'text']
+        rows = [row.split('\t') for row in tsv.strip('\n').split('\n') if row]
+        if rows and rows[0] == header:
+            rows.pop(0)
+
+        data = {key: [] for key in header}
+        for row in rows:
+            row = row + [''] * (len(header) - len(row))
+            for i, key in enumerate(header):
+                val = row[i]
+                if key != 'text':
+                    try:
+                        val = int(float(val))
+                    except ValueError:
+                        pass
+                data[key].append(val)
+        return data
+
 
     @staticmethod
     def formattedPytesseractImageData(data):
@@ -85,6 +121,9 @@ class OCR:
         raise ValueError('Are you sure the correct pytesseract input is provided? Expecting a dict but got %s' % str(type(data)))
 
     class TextGroup:
+        '''A group of words close to each other in an image, along with their bounding box. Slotted, as an OCR pass creates many.'''
+
+        __slots__ = ('__top', '__left', '__width', '__height', '__wordlist')
 
         def __init__(self, top: int, left: int, width: int, height: int, text: str = None):
 
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+from multiprocessing import Pool, cpu_count
+from PIL import Image
+import pytesseract
+try:
+    from ocr import OCR
+except ImportError:
+    from .ocr import OCR
+
+_workerApi = None
+
+def _initWorker(lang: str):
+    '''Loads the OCR engine once for this worker process.'''
+    global _workerApi
+    try:
+        import tesserocr
+    except ImportError:
+        #tesserocr isn't installed, so each read falls back to running tesseract via pytesseract (warned about by OCRPool)
+        _workerApi = None
+        return
+    try:
+        _workerApi = tesserocr.PyTessBaseAPI(lang=lang)
+    except RuntimeError as e:
+        print('warning: OCR worker failed to load tesserocr (%s), falling back to a tesseract process per image via pytesseract' % e)
+        _workerApi = None
+
+def _readImage(args):
+    meme, normalized = args
+    if isinstance(meme, str):
+        meme = Image.open(meme)
+    if normalized:
+        meme = OCR.normalizedImage(meme)
+
+    if _workerApi is not None:
+        _workerApi.SetImage(meme)
+        rawdata = OCR.parseImageDataTsv(_workerApi.GetTSVText(0))
+    else:
+        rawdata = pytesseract.image_to_data(meme, output_type=pytesseract.Output.DICT)
+    return OCR.textFromImageData(rawdata)
+
+class OCRPool:
+    '''
+    A pool of long-lived OCR worker processes which are fed images over a queue.
+
+    Each worker loads its OCR engine once when it starts, using tesserocr's in-process API if it is installed,
+    so no tesseract process is started per image. Otherwise, it falls back to pytesseract, which is warned about when the pool starts.
+
+    Results are the same as OCR.read2, and the pool can be used as a context manager to close it afterwards.
+    '''
+
+    def __init__(self, workers: int = None, lang: str = 'eng'):
+        '''
+        Starts the worker processes.
+
+        Parameters:
+        - workers : The number of worker processes. Defaults to the number of cpus.
+        - lang    : The tesseract language to load in each worker.
+        '''
+        self.workers = max(1, workers if workers else cpu_count())
+        if not OCRPool.hasInProcessEngine():
+            print('warning: tesserocr is not installed, so OCR workers fall back to a tesseract process per image via pytesseract. '
+                  'install tesserocr (pip install tesserocr) for long-lived in-process engines.')
+        self.__pool = Pool(self.workers, initializer=_initWorker, initargs=(lang,))
+
+    @staticmethod
+    def hasInProcessEngine() -> bool:
+        '''Returns whether tesserocr is installed, so workers can read images without starting a tesseract process per image.'''
+        try:
+            import tesserocr
+        except ImportError:
+            return False
+        return True
+
+    def read2(self, meme, normalized=False) -> str:
+        '''
+        Reads the image (a filename or PIL image) in a worker, returning the same result as OCR.read2.
+        This blocks until it's read, so only one worker is busy; use read2Async or map to read several images at once.
+        '''
+        return self.__pool.apply(_readImage, ((meme, normalized),))
+
+    def read2Normalized(self, meme) -> str:
+        return self.read2(meme, normalized=True)
+
+    def read2Async(self, meme, normalized=False):
+        '''Queues the image to be read in a worker, returning a multiprocessing AsyncResult of the text.'''
+        return self.__pool.apply_async(_readImage, ((meme, normalized),))
+
+    def map(self, memes: list, normalized=False) -> list:
+        '''Reads all images across the workers, returning their texts in order.'''
+        return self.__pool.map(_readImage, [(meme, normalized) for meme in memes])
+
+    def close(self):
+        '''Stops the worker processes once they've completed all queued images.'''
+        self.__pool.close()
+        self.__pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
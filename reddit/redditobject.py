@@ -1,20 +1,53 @@
 #!/usr/bin/env python3
 
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 import json
+import os
 import requests
-import time
-import datetime
+import threading
+try:
+    from tokenbucket import TokenBucket
+    from responsecache import ResponseCache
+except ImportError:
+    from reddit.tokenbucket import TokenBucket
+    from reddit.responsecache import ResponseCache
 
 class RedditObject:
-    """The base class for all reddit objects."""
+    """
+    The base class for all reddit objects.
+
+    All requests share a pool of keep-alive connections and a token bucket rate limiter,
+    so they may be sent concurrently from threads (as in bulk retrieval) or asyncio tasks (via the Async methods)
+    while staying within the allowed request rate.
+
+    Subclasses register their objects by name or id in weak registries, so the same object is returned for the same
+    name or id while it's referenced, but objects which aren't referenced anymore are freed, e.g. in long running scrapes.
+
+    Class variables that can be modified:
+    - base_url: the url reddit is accessed at, e.g. a local stand-in server for testing.
+    - rate_limiter: the TokenBucket all requests take a token from. Defaults to 1 request per second.
+    - max_connections: the maximum number of concurrent requests, i.e. pooled connections and worker threads.
+    - timeout: the number of seconds to wait for a server response before giving up on a request.
+    - response_cache: a ResponseCache responses are stored in and revalidated from, or None to always send full requests.
+    - keep_raw_json: whether objects keep the raw JSON they're processed from (see getRawJson). Dropping it saves memory in long scrapes.
+    """
 
     headers = {
         'User-Agent': 'python:GeneralRepostiRedditScraper:v0.9 (by /u/no_comments_no_posts)',
         'Accept-Language': 'en-GB,en;q=0.5',
-        'Connection': 'close',
     }
+    base_url = 'https://www.reddit.com'
+    rate_limiter = TokenBucket(rate=1.0, capacity=1.0)
+    max_connections = 8
+    timeout = 60
+    response_cache = None
+    keep_raw_json = True
+
+    #subclasses may be slotted, so reddit objects have no per-instance state here (headers are read from the class)
+    __slots__ = ('__weakref__',)
     def __init__(self):
-        self.headers = self.__class__.headers
+        pass
 
     class MalformedUrlError(RuntimeError):
         """A representation of an error caused by an invalid url input"""
@@ -29,29 +62,160 @@ class RedditObject:
             return '[' + str(self.code) + '] ' + super().__str__()
 
 
-    __last_retrieve_timestamp = 0
+    __session = None
+    __executor = None
+    __pool_lock = threading.Lock()
     @classmethod
-    def retrieveRawData(cls, url: str) -> requests.Request:
-        """Retrieves the request and returns a requests.Request object"""
+    def _getSession(cls) -> requests.Session:
+        """Returns the session shared by all requests, which keeps up to max_connections connections alive per host."""
+        with RedditObject.__pool_lock:
+            if RedditObject.__session is None:
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=RedditObject.max_connections,
+                                                        pool_maxsize=RedditObject.max_connections)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                RedditObject.__session = session
+            return RedditObject.__session
 
-        #request limit to 60 times per minute
-        time_delay = max(0, cls.__last_retrieve_timestamp - datetime.datetime.now().timestamp() + 1)
-        cls.__last_retrieve_timestamp = datetime.datetime.now().timestamp()
+    @classmethod
+    def _getExecutor(cls) -> ThreadPoolExecutor:
+        """Returns the thread pool requests are sent from when retrieving concurrently."""
+        with RedditObject.__pool_lock:
+            if RedditObject.__executor is None:
+                RedditObject.__executor = ThreadPoolExecutor(RedditObject.max_connections)
+            return RedditObject.__executor
 
-        time.sleep(time_delay)
+    @classmethod
+    def _getCachedResponse(cls, url: str):
+        """Returns the cached response of the url from the response cache if there is one, or None otherwise."""
+        if RedditObject.response_cache is None:
+            return None
+        return RedditObject.response_cache.get(url)
+
+    @classmethod
+    def _sendRequest(cls, url: str, cached = None) -> requests.Response:
+        """Sends the request with the relevant headers, revalidating the cached response if given, and stores the response in the response cache."""
+        headers = cls.headers if cached is None else dict(cls.headers, **cached.getValidators())
+        res = cls._getSession().get(url, headers=headers, timeout=cls.timeout)
+        if RedditObject.response_cache is not None:
+            res = RedditObject.response_cache.store(url, res, cached)
+        return res
 
-        #send the request with teh relevant headers
+    @classmethod
+    def retrieveRawData(cls, url: str) -> requests.Response:
+        """
+        Retrieves the request and returns a requests.Response object, waiting for the rate limiter if necessary.
+        If the response is fresh in the response cache, it's returned without sending a request.
+        """
+        cached = cls._getCachedResponse(url)
+        if cached is not None and cached.isFresh():
+            return cached.toResponse()
+
+        RedditObject.rate_limiter.wait()
+        print(url)
+        return cls._sendRequest(url, cached)
+
+    @classmethod
+    async def retrieveRawDataAsync(cls, url: str) -> requests.Response:
+        """Retrieves the request as per retrieveRawData, without blocking the event loop while waiting for the rate limiter or the response."""
+        cached = cls._getCachedResponse(url)
+        if cached is not None and cached.isFresh():
+            return cached.toResponse()
+
+        await RedditObject.rate_limiter.acquire()
         print(url)
-        return requests.get(url, headers=cls.headers)
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(cls._getExecutor(), cls._sendRequest, url, cached)
+
+    @classmethod
+    def _streamToFile(cls, url: str, path: str, cached = None, chunk_callback = None):
+        """
+        Writes the body of the response of the url into the file at path, from the cached response if it's fresh,
+        or otherwise by streaming it from a (possibly conditional) request. The response cache is updated accordingly.
+        """
+        chunk_size = 64*1024
+        tmp_path = path + '.part'
+        try:
+            res = None
+            if cached is None or not cached.isFresh():
+                headers = cls.headers if cached is None else dict(cls.headers, **cached.getValidators())
+                res = cls._getSession().get(url, headers=headers, timeout=cls.timeout, stream=True)
+                if res.status_code == 304 and cached is not None:
+                    cached = RedditObject.response_cache.refresh(url, res, cached)
+                    res.close()
+                    res = None
+                elif res.status_code != 200:
+                    res.close()
+                    raise cls.InvalidResponseError(res.reason, res.status_code)
+
+            with open(tmp_path, 'wb') as f:
+                if res is not None:
+                    with res:
+                        chunks = res.iter_content(chunk_size)
+                        for chunk in chunks:
+                            f.write(chunk)
+                            if chunk_callback:
+                                chunk_callback(chunk)
+                else:
+                    with open(cached.getBodyPath(), 'rb') as body:
+                        for chunk in iter(lambda: body.read(chunk_size), b''):
+                            f.write(chunk)
+                            if chunk_callback:
+                                chunk_callback(chunk)
+            if res is not None and RedditObject.response_cache is not None:
+                RedditObject.response_cache.storeFile(url, res, tmp_path)
+            os.replace(tmp_path, path)
+        except requests.exceptions.RequestException as e:
+            raise cls.InvalidResponseError(str(e), -2)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    @classmethod
+    def retrieveRawDataToFile(cls, url: str, path: str, chunk_callback = None):
+        """
+        Retrieves the request as per retrieveRawData, but streams the body of the response into the file at path
+        rather than holding it in memory. chunk_callback is called with each chunk of the body as it's written,
+        e.g. to decode it in the same pass. Raises an InvalidResponseError if the request isn't successful.
+        """
+        cached = cls._getCachedResponse(url)
+        if cached is None or not cached.isFresh():
+            RedditObject.rate_limiter.wait()
+            print(url)
+        cls._streamToFile(url, path, cached, chunk_callback)
+
+    @classmethod
+    async def retrieveRawDataToFileAsync(cls, url: str, path: str, chunk_callback = None):
+        """Retrieves the request into the file at path as per retrieveRawDataToFile, without blocking the event loop."""
+        cached = cls._getCachedResponse(url)
+        if cached is None or not cached.isFresh():
+            await RedditObject.rate_limiter.acquire()
+            print(url)
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(cls._getExecutor(), cls._streamToFile, url, path, cached, chunk_callback)
 
     def _retrieveRawResponse(self, url: str):
         """Retrieves the raw response provided by reddit with the given url via a standard request."""
         try:
             res = self.__class__.retrieveRawData(url)
-            res = res.json()
         except requests.exceptions.RequestException as e:
             raise self.__class__.InvalidResponseError(str(e), -2)
-        except json.decoder.JSONDecodeError:
+        return self._parseRawResponse(res)
+
+    async def _retrieveRawResponseAsync(self, url: str):
+        """Retrieves the raw response provided by reddit with the given url as per _retrieveRawResponse, asynchronously."""
+        try:
+            res = await self.__class__.retrieveRawDataAsync(url)
+        except requests.exceptions.RequestException as e:
+            raise self.__class__.InvalidResponseError(str(e), -2)
+        return self._parseRawResponse(res)
+
+    def _parseRawResponse(self, res: requests.Response):
+        """Parses a response provided by reddit, raising an InvalidResponseError if it isn't valid."""
+        try:
+            res = res.json()
+        except json.decoder.JSONDecodeError as e:
             raise self.__class__.InvalidResponseError(str(e), -3)
 
         checks = res
@@ -78,8 +242,8 @@ class RedditObject:
             elif tmpType != x.__class__:
                 raise ValueError('Not all objects provided in the objects list are of the same type.')
 
-        #TODO: Implement bulk retrieval
-        return [objects[i]._retrieveRawResponse(u) for i, u in enumerate(urlList)]
+        #requests are sent concurrently, within the rate limit, and the responses are returned in order
+        return list(cls._getExecutor().map(lambda x: x[0]._retrieveRawResponse(x[1]), zip(objects, urlList)))
 
     def _process(self, jsonObject):
         """Processes the given json object and embed it into self."""
@@ -96,6 +260,10 @@ class RedditObject:
         """Retrieves the response provided by reddit and embed it on self."""
         return self._process(self._retrieveRawResponse(url))
 
+    async def _retrieveAsync(self, url: str):
+        """Retrieves the response provided by reddit and embed it on self, asynchronously."""
+        return self._process(await self._retrieveRawResponseAsync(url))
+
     def retrieve(self):
         """Retrieves the contents of the object from reddit. This method should return self to allow for chaining."""
         raise NotImplementedError()
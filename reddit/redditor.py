@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 
+import weakref
 try:
     from redditobject import RedditObject
 except ImportError:
@@ -17,11 +18,12 @@ class Redditor(RedditObject):
         self.__posts = []
         self.__comments = []
 
-    __redditor_dict = {}
+    __redditor_dict = weakref.WeakValueDictionary()
     @classmethod
     def get(cls, name: str):
-        if name in cls.__redditor_dict:
-            return cls.__redditor_dict[name]
+        obj = cls.__redditor_dict.get(name)
+        if obj is not None:
+            return obj
         new_obj = cls(cls.__init_key, name)
         cls.__redditor_dict[name] = new_obj
         return new_obj
@@ -35,7 +37,7 @@ class Redditor(RedditObject):
 
     def getUrl(self) -> str:
         """Returns the full url of the user"""
-        return 'https://www.reddit.com/user/' + self.__username
+        return self.base_url + '/user/' + self.__username
 
     def getCommentsUrl(self) -> str:
         """Returns the full url to access the user's comment history."""
@@ -79,5 +81,13 @@ class Redditor(RedditObject):
     def getPosts(self):
         return self.__posts
 
+    def clearComments(self):
+        """Drops the retrieved comments. They'll be retrieved again if retrieve is called again."""
+        self.__comments = []
+
+    def clearPosts(self):
+        """Drops the retrieved posts. They'll be retrieved again if retrieve is called again."""
+        self.__posts = []
+
     def __repr__(self):
         return '[Redditor ' + self.getFormattedUsername() + ' <' + str(hex(id(self))) + '>]'
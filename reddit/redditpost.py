@@ -1,8 +1,10 @@
 #!/usr/bin/env python3
 
 from io import BytesIO, StringIO
-from PIL import Image
+from PIL import Image, ImageFile
 from markdown import Markdown
+import os
+import weakref
 try:
     from subreddit import Subreddit
     from redditor import Redditor
@@ -15,6 +17,10 @@ except ImportError:
 class RedditPost(RedditObject):
     """Abstract representation of a single reddit post"""
 
+    #slotted, as hundreds of thousands of posts may be held during a large listing crawl
+    __slots__ = ('__subreddit', '__id', '__slug', '__post_title', '__post_flair_text', '__post_crosspost_url',
+                 '__post_image_url', '__post_image', '__author', '__score', '__comments', '__cached_json_obj')
+
     __init_key = object()
     def __init__(self, init_key, subreddit: Subreddit, post_id: str, post_slug: str):
         assert(init_key == self.__class__.__init_key), \
@@ -33,11 +39,12 @@ class RedditPost(RedditObject):
         self.__comments = []
         self.__cached_json_obj = None
 
-    __posts_dict = {}
+    __posts_dict = weakref.WeakValueDictionary()
     @classmethod
     def get(cls, subreddit: Subreddit, post_id: str, post_slug: str = None):
-        if post_id in cls.__posts_dict:
-            return cls.__posts_dict[post_id]
+        obj = cls.__posts_dict.get(post_id)
+        if obj is not None:
+            return obj
         new_obj = cls(cls.__init_key, subreddit, post_id, post_slug)
         cls.__posts_dict[post_id] = new_obj
         return new_obj
@@ -96,13 +103,18 @@ class RedditPost(RedditObject):
                 elif 'reddit.com' in postJson['data']['url'].split('/')[2]:
                     self.__post_crosspost_url = postJson['data']['url']
 
-        self.__cached_json_obj = jsonObject
+        self.__cached_json_obj = jsonObject if self.keep_raw_json else None
 
     def retrieve(self):
         """Retrieves the data within this comment and saves it to self"""
         self._retrieve(self.getUrl() + '.json')
         return self
 
+    async def retrieveAsync(self):
+        """Retrieves the data within this post and saves it to self, asynchronously."""
+        await self._retrieveAsync(self.getUrl() + '.json')
+        return self
+
 
     #Getters
     def getSubreddit(self) -> Subreddit:
@@ -141,6 +153,58 @@ class RedditPost(RedditObject):
             pass
         return None
 
+    async def getImageAsync(self) -> Image:
+        """Returns the image as per getImage, downloading it asynchronously if necessary, so other requests can be sent meanwhile."""
+        try:
+            if not self.__post_image and self.getImageUrl():
+                data = await self.__class__.retrieveRawDataAsync(self.getImageUrl())
+                self.__post_image = Image.open(BytesIO(data.content))
+
+            if self.__post_image:
+                return self.__post_image
+        except RuntimeError:
+            pass
+        return None
+
+    def downloadImage(self, path: str, decode: bool = True):
+        """
+        Streams the image straight into the file at path, decoding it in the same pass if decode is True.
+        Unlike getImage, the raw image is never held in memory whole, and the image isn't kept on the post.
+
+        Returns the image as a PIL Image object if decoding, otherwise the path, or None if the image isn't available.
+        """
+        if not self.getImageUrl():
+            return None
+        parser = ImageFile.Parser() if decode else None
+        try:
+            self.__class__.retrieveRawDataToFile(self.getImageUrl(), path, parser.feed if decode else None)
+        except (RuntimeError, OSError):
+            return None
+        return self.__class__.__finishDownload(path, parser)
+
+    async def downloadImageAsync(self, path: str, decode: bool = True):
+        """Streams the image into the file at path as per downloadImage, asynchronously."""
+        if not self.getImageUrl():
+            return None
+        parser = ImageFile.Parser() if decode else None
+        try:
+            await self.__class__.retrieveRawDataToFileAsync(self.getImageUrl(), path, parser.feed if decode else None)
+        except (RuntimeError, OSError):
+            return None
+        return self.__class__.__finishDownload(path, parser)
+
+    @staticmethod
+    def __finishDownload(path: str, parser):
+        """Returns the image decoded by the parser (or the path if not decoding). A file which can't be decoded is deleted, so it isn't taken as downloaded later."""
+        if parser is None:
+            return path
+        try:
+            return parser.close()
+        except (RuntimeError, OSError):
+            if os.path.exists(path):
+                os.remove(path)
+            return None
+
     def getImageHumanTranscription(self) -> str:
         """Returns a transcription of the image formatted in markdown by a human from r/transcribersofreddit, if comments are retrieved and one such comment exists, otherwise None."""
 
@@ -196,6 +260,14 @@ class RedditPost(RedditObject):
     def getComments(self) -> list:
         return self.__comments
 
+    def clearComments(self):
+        """Drops the retrieved comments. They'll be retrieved again if retrieve is called again."""
+        self.__comments = []
+
+    def getRawJson(self):
+        """Returns the raw JSON the post was last processed from. It's None if not yet retrieved, or if keep_raw_json is False."""
+        return self.__cached_json_obj
+
 
 
     def __repr__(self):
@@ -216,6 +288,8 @@ class RedditPost(RedditObject):
 class RedditComment(RedditObject):
     """Abstract representation of a single reddit comment"""
 
+    __slots__ = ('__post', '__id', '__author', '__comment_text', '__score', '__cached_json_obj')
+
     __init_key = object()
     def __init__(self, init_key, reddit_post: RedditPost, comment_id: str):
         assert(init_key == self.__class__.__init_key), \
@@ -228,11 +302,12 @@ class RedditComment(RedditObject):
         self.__score = None
         self.__cached_json_obj = None
 
-    __comments_dict = {}
+    __comments_dict = weakref.WeakValueDictionary()
     @classmethod
     def get(cls, post: RedditPost, comment_id: str):
-        if comment_id in cls.__comments_dict:
-            return cls.__comments_dict[comment_id]
+        obj = cls.__comments_dict.get(comment_id)
+        if obj is not None:
+            return obj
         new_obj = cls(cls.__init_key, post, comment_id)
         cls.__comments_dict[comment_id] = new_obj
         return new_obj
@@ -268,7 +343,7 @@ class RedditComment(RedditObject):
         self.__author = Redditor.get(jsonObject['data']['author'])
         self.__comment_text = jsonObject['data']['body']
         self.__score = jsonObject['data']['score']
-        self.__cached_json_obj = jsonObject
+        self.__cached_json_obj = jsonObject if self.keep_raw_json else None
 
     def retrieve(self):
         """Retrieves the data within this comment and saves it to self."""
@@ -308,6 +383,10 @@ class RedditComment(RedditObject):
         """Returns the score of the comment (upvotes - downvotes). It may be None if not yet retrieved."""
         return self.__score
 
+    def getRawJson(self):
+        """Returns the raw JSON the comment was last processed from. It's None if not yet retrieved, or if keep_raw_json is False."""
+        return self.__cached_json_obj
+
 
 
     def __repr__(self):
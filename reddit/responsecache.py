@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+
+import hashlib
+import json
+import os
+import requests
+import shutil
+import time
+
+class CachedResponse:
+    """A cached response on disk, along with its validators and when it expires."""
+
+    def __init__(self, cache, url: str, meta: dict):
+        self.__cache = cache
+        self.__url = url
+        self.__meta = meta
+
+    def getUrl(self) -> str:
+        return self.__url
+
+    def getMeta(self) -> dict:
+        return self.__meta
+
+    def getBodyPath(self) -> str:
+        """Returns the path of the file holding the body of the response."""
+        return self.__cache.getBodyPath(self.__url)
+
+    def isFresh(self) -> bool:
+        """Returns whether the response can be used without revalidating it with the server."""
+        return time.time() < self.__meta['expires']
+
+    def getValidators(self) -> dict:
+        """Returns the headers of a conditional request revalidating this response."""
+        headers = {}
+        if self.__meta.get('etag'):
+            headers['If-None-Match'] = self.__meta['etag']
+        if self.__meta.get('last_modified'):
+            headers['If-Modified-Since'] = self.__meta['last_modified']
+        return headers
+
+    def toResponse(self) -> requests.Response:
+        """Returns the cached response as a requests.Response, with from_cache set to True."""
+        res = requests.Response()
+        res.status_code = 200
+        res.url = self.__url
+        res.headers = requests.structures.CaseInsensitiveDict(self.__meta['headers'])
+        res.encoding = requests.utils.get_encoding_from_headers(res.headers)
+        with open(self.getBodyPath(), 'rb') as f:
+            res._content = f.read()
+        res.from_cache = True
+        return res
+
+class ResponseCache:
+    """
+    A persistent cache of HTTP responses in a directory, keyed by url.
+
+    Each response is stored with its ETag and Last-Modified validators, and a time to live taken from its
+    Cache-Control max-age (or default_ttl without one). Fresh responses are used without any request, and stale ones
+    are revalidated via conditional requests, so unchanged responses only cost a 304 Not Modified response.
+
+    variables that can be modified:
+    - default_ttl: the number of seconds a response without a Cache-Control max-age stays fresh.
+    """
+
+    def __init__(self, directory: str = os.path.join('scraper_cache', '__http_cache__'), default_ttl: float = 0):
+        self.directory = directory
+        self.default_ttl = default_ttl
+        os.makedirs(directory, exist_ok=True)
+
+    def __getKey(self, url: str) -> str:
+        return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+    def getBodyPath(self, url: str) -> str:
+        return os.path.join(self.directory, self.__getKey(url) + '.body')
+
+    def __getMetaPath(self, url: str) -> str:
+        return os.path.join(self.directory, self.__getKey(url) + '.json')
+
+    def get(self, url: str) -> CachedResponse:
+        """Returns the cached response of the url, or None if there isn't one."""
+        try:
+            with open(self.__getMetaPath(url), 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except (FileNotFoundError, json.decoder.JSONDecodeError):
+            return None
+        if meta.get('url') != url or not os.path.isfile(self.getBodyPath(url)):
+            return None
+        return CachedResponse(self, url, meta)
+
+    def __getTtl(self, headers) -> float:
+        '''returns the time to live of a response given its headers, or None if it mustn't be stored'''
+        directives = {}
+        for directive in headers.get('Cache-Control', '').split(','):
+            key, _, value = directive.strip().partition('=')
+            directives[key.lower()] = value.strip('"')
+        if 'no-store' in directives:
+            return None
+        if 'no-cache' in directives:
+            return 0
+        try:
+            return max(0, int(directives['max-age']))
+        except (KeyError, ValueError):
+            return self.default_ttl
+
+    def __writeMeta(self, url: str, meta: dict):
+        path = self.__getMetaPath(url)
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(path + '.tmp', path)
+
+    def __createMeta(self, url: str, headers, ttl: float) -> dict:
+        return {'url': url,
+                'etag': headers.get('ETag'),
+                'last_modified': headers.get('Last-Modified'),
+                'headers': {key: headers[key] for key in ('Content-Type', 'ETag', 'Last-Modified') if key in headers},
+                'expires': time.time() + ttl}
+
+    def store(self, url: str, res: requests.Response, cached: CachedResponse = None) -> requests.Response:
+        """
+        Stores the response of a (possibly conditional) request of the url, and returns the response to use.
+
+        A 304 Not Modified response of a request revalidating the cached response refreshes it, and the cached response is
+        returned instead. Other successful responses are stored and returned as is.
+        """
+        if res.status_code == 304 and cached is not None:
+            return self.refresh(url, res, cached).toResponse()
+        meta = self.__getStorableMeta(url, res)
+        if meta is None:
+            return res
+
+        path = self.getBodyPath(url)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(res.content)
+        os.replace(path + '.tmp', path)
+        self.__writeMeta(url, meta)
+        return res
+
+    def storeFile(self, url: str, res: requests.Response, body_path: str):
+        """Stores a successful response of the url whose body was streamed into the file at body_path, as per store."""
+        meta = self.__getStorableMeta(url, res)
+        if meta is None:
+            return
+        path = self.getBodyPath(url)
+        shutil.copyfile(body_path, path + '.tmp')
+        os.replace(path + '.tmp', path)
+        self.__writeMeta(url, meta)
+
+    def refresh(self, url: str, res: requests.Response, cached: CachedResponse) -> CachedResponse:
+        """Refreshes the cached response given a 304 Not Modified response revalidating it, and returns the refreshed response."""
+        meta = dict(cached.getMeta())
+        meta['expires'] = time.time() + (self.__getTtl(res.headers) or 0)
+        for key, header in (('etag', 'ETag'), ('last_modified', 'Last-Modified')):
+            if header in res.headers:
+                meta[key] = res.headers[header]
+                meta['headers'][header] = res.headers[header]
+        self.__writeMeta(url, meta)
+        return CachedResponse(self, url, meta)
+
+    def __getStorableMeta(self, url: str, res: requests.Response) -> dict:
+        '''returns the metadata to store a response with, or None if it shouldn't be stored'''
+        ttl = self.__getTtl(res.headers)
+        if res.status_code != 200 or ttl is None:
+            return None
+        meta = self.__createMeta(url, res.headers, ttl)
+        if ttl == 0 and not meta['etag'] and not meta['last_modified']:
+            #the response could neither be used as is nor revalidated
+            return None
+        return meta
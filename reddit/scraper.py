@@ -5,41 +5,215 @@ try:
     from redditor import Redditor
     from redditpost import RedditPost, RedditComment
     from redditobject import RedditObject
+    from responsecache import ResponseCache
 except ImportError:
     from reddit.subreddit import Subreddit
     from reddit.redditor import Redditor
     from reddit.redditpost import RedditPost, RedditComment
     from reddit.redditobject import RedditObject
+    from reddit.responsecache import ResponseCache
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+import asyncio
+import json
 import os
+import sys
+
+if __name__ == "__main__":
+    #the repository root, for the hasher and repost packages when this is run as a script
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from hasher import Hasher, MultiIndexHash
+
+class RepostRejecter:
+    """
+    Rejects reposts of already scraped images as they're downloaded, before they're stored or read.
+
+    With a repost checker, each new image is checked against the checker's images with the same thresholds as
+    RepostChecker.checkRepostDetection, via RepostChecker.addImageUnlessRepost. It's hashed once, and it's only read if
+    it's added, or if it has candidates by image similarity and isn't an exact duplicate of a scraped image.
+    Reposts are deleted rather than stored.
+
+    Without one, each new image is digested via Hasher.digestImage, and rejected if it has the same pixels as an image
+    scraped in this run. Otherwise it's hashed via Hasher.hashImage and looked up in an in-memory image hash index of the
+    scraped images. Texts aren't compared then, so images similar to a scraped image (e.g. new memes made from the same template)
+    can't be told apart from reposts. They're kept and only recorded as repost candidates.
+
+    The linkage is recorded in __reposts__.json in the directory, mapping the file names of reposts and candidates to
+    the post, the scraped image they're similar to, and whether they were rejected.
+    """
+    def __init__(self, directory: str, checker = None, img_sim_min: float = 0.8, text_sim_min: float = 0.7, imagehash_method: str = 'dHash'):
+        """
+        Parameters:
+        - directory: the directory images are scraped into.
+        - checker: a RepostChecker of the directory which images are added to, or None to only index their hashes in memory.
+        - imagehash_method: the image hashing method, if no checker is given.
+        """
+        self.img_sim_min = img_sim_min
+        self.text_sim_min = text_sim_min
+        self.__checker = checker
+        self.__method = checker.getImageHashMethod() if checker is not None else imagehash_method
+        self.__index = MultiIndexHash() if checker is None else None
+        self.__digests = {}
+        self.__path = os.path.join(directory, '__reposts__.json')
+        self.__reposts = {}
+        if os.path.isfile(self.__path):
+            with open(self.__path, 'r', encoding='utf-8') as f:
+                self.__reposts = json.load(f)
+
+    def getReposts(self) -> dict:
+        """Returns the recorded linkage of rejected reposts, mapping their file names to what they're reposts of."""
+        return self.__reposts
+
+    def addImage(self, post: RedditPost, name: str, img) -> bool:
+        """
+        Adds the decoded image of the post, saved in the directory as name, unless it's a repost of a scraped image,
+        in which case it's deleted and recorded instead. Returns True if it was added, or False if it was rejected.
+        """
+        if self.__checker is not None:
+            added, reposts = self.__checker.addImageUnlessRepost(name, self.img_sim_min, self.text_sim_min, save=False, image=img) or (True, [])
+        else:
+            digest = Hasher.digestImage(img)
+            if digest in self.__digests:
+                #the same pixels as a scraped image, so it's a repost whatever its text
+                reposts = [(self.__digests[digest], 0.0, 1.0)]
+                added = False
+            else:
+                img_hash = Hasher.hashImage(img, self.__method)
+                reposts = [(key, img_diff, None) for key, img_diff in self.__index.query(img_hash, 1-self.img_sim_min)]
+                reposts.sort(key=lambda x: x[1])
+                #without texts, a similar image may be a new meme made from the same template, so it's kept
+                added = True
+                self.__index.add(name, img_hash)
+                self.__digests[digest] = name
+
+        if not reposts:
+            return True
+        if not added:
+            os.remove(os.path.join(os.path.dirname(self.__path), name))
+        key, img_diff, text_sim = reposts[0]
+        self.__reposts[name] = {'post': post.getId(), 'url': post.getImageUrl(), 'repostOf': key, 'imgDiff': img_diff, 'textSim': text_sim,
+                                'rejected': not added}
+        with open(self.__path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(self.__reposts, f, indent=4)
+        os.replace(self.__path + '.tmp', self.__path)
+        print('%s %s as a repost of %s' % ('rejected' if not added else 'kept candidate', name, key))
+        return added
+
+async def downloadImage(post: RedditPost, path: str, index = None, executor = None):
+    """
+    Downloads the image of the post to the path, unless it was already downloaded.
+
+    If index is given, the image is decoded while it's streamed to disk, and index is called with the post, the file name
+    and the decoded image via the executor, e.g. to add it to a repost checker without decoding it again.
+    """
+    if os.path.exists(path):
+        print('image already downloaded')
+        return
+    img = await post.downloadImageAsync(path, decode=index is not None)
+    if img is None:
+        print('failed to download image from post %s' % post.getId())
+        return
+    print('saved image')
+    if index is not None:
+        await asyncio.get_event_loop().run_in_executor(executor, index, post, os.path.basename(path), img)
+
+async def scrape(subreddit: Subreddit, directory: str, post_count: int = 1000, checker = None, rejecter: RepostRejecter = None):
+    """
+    Retrieves at least post_count posts of the subreddit (or as many as there are), and downloads their images into the directory.
+
+    Images are downloaded concurrently with each other and with the retrieval of subsequent pages of posts,
+    so the rate limit of RedditObject.rate_limiter is fully used rather than waiting for each image in turn.
+
+    If a RepostChecker of the directory is given, each image is fetched, decoded, hashed, read and indexed exactly once:
+    it's streamed to disk and decoded in the same pass, and added to the checker from the decoded image.
+    Images are added one at a time, and the checker's cache is saved every checker.commit_every images.
+
+    If a RepostRejecter is given (with the same checker, if any), images are added via it,
+    so reposts of images scraped before are rejected rather than stored.
+
+    Memory stays flat however many posts are scraped: the subreddit's posts are cleared after each page is queued,
+    only the ids of retrieved posts are kept, and downloads are forgotten once they succeed, so each post
+    (along with its comments and image) is freed once its image is downloaded.
+    """
+    create_filepath = lambda x: os.path.join(directory, x)
+    downloads = set()
+    queued = set()
+    queued_images = [0]
+    index = None
+    index_executor = None
+    if checker is not None or rejecter is not None:
+        #the checker and the rejecter are only ever used by a single thread
+        index_executor = ThreadPoolExecutor(1)
+        added = [0]
+        def index(post, name, img):
+            if rejecter is not None:
+                rejecter.addImage(post, name, img)
+            else:
+                checker.addImage(name, save=False, image=img)
+            added[0] += 1
+            if checker is not None and added[0] % checker.commit_every == 0:
+                checker.saveProcessedDataToCache()
+
+    def forgetDownload(task):
+        #failed downloads are kept, so gathering them raises their error as before
+        if task.cancelled() or task.exception() is None:
+            downloads.discard(task)
+
+    def queueDownloads():
+        for p in subreddit.getPosts():
+            if p.getId() not in queued:
+                queued.add(p.getId())
+                if p.getImageUrl():
+                    ext = p.getImageUrl().split('/')[-1].split('.')[-1]
+                    path = create_filepath(subreddit.getName() + '_' + p.getId() + '.' + ext)
+                    task = asyncio.ensure_future(downloadImage(p, path, index, index_executor))
+                    task.add_done_callback(forgetDownload)
+                    downloads.add(task)
+                    queued_images[0] += 1
+        subreddit.clearPosts()
+
+    print('retrieving subreddit posts')
+    await subreddit.retrievePostsAsync()
+    queueDownloads()
+    while len(queued) < post_count and subreddit.hasSubsequentPages():
+        print('retrieving additional posts...')
+        await subreddit.retrievePostsAsync(use_next=True)
+        queueDownloads()
+
+    print('downloading images from %d posts' % queued_images[0])
+    try:
+        await asyncio.gather(*downloads)
+    finally:
+        if checker is not None:
+            index_executor.submit(checker.saveProcessedDataToCache).result()
+        if index_executor is not None:
+            index_executor.shutdown()
+
 if __name__ == "__main__":
     directory = "scraper_cache_%s" % (datetime.now().isoformat())
     if not os.path.exists(directory):
         os.makedirs(directory)
-    create_filepath = lambda x: directory + "/" + x
 
-    s = Subreddit.get('memes')
-    print('retrieving subreddit posts')
-    s.retrievePosts()
-    while len(s.getPosts()) < 1000 and s.hasSubsequentPages():
-        print('retrieving additional posts...')
-        s.retrievePosts(use_next=True)
+    #listings and images of previous scrapes are revalidated rather than retrieved again
+    RedditObject.response_cache = ResponseCache(os.path.join('scraper_cache', '__http_cache__'))
+    RedditObject.keep_raw_json = False
+
+    checker = None
+    print('hash, read and index images into a repost store while downloading them? [y/N]')
+    if input().lower().startswith('y'):
+        from repost.repost_checker import RepostChecker
+        checker = RepostChecker(directory)
+        checker.index_method = 'mih'
+        checker.setSqliteCacheFilenameTarget()
+        checker.readProcessedDataFromCache()
+
+    rejecter = None
+    print('reject reposts of already scraped images instead of storing them? [y/N]')
+    if input().lower().startswith('y'):
+        rejecter = RepostRejecter(directory, checker)
 
-    posts = s.getPosts()
     try:
-        for i, p in enumerate(posts):
-            print('downloading image from post %d of %d' % (i + 1, len(posts)))
-            if p.getImageUrl():
-                ext = p.getImageUrl().split('/')[-1].split('.')[-1]
-                path = create_filepath(s.getName() + '_' + p.getId() + '.' + ext)
-                if not os.path.exists(path):
-                    img = p.getImage()
-                    if img:
-                        img.save(path)
-                        print('saved image')
-                    p.unloadImage()
-                else:
-                    print('image already downloaded')
+        asyncio.run(scrape(Subreddit.get('memes'), directory, checker=checker, rejecter=rejecter))
     except KeyboardInterrupt:
         pass
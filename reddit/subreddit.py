@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 
+import weakref
 try:
     from redditobject import RedditObject
 except ImportError:
@@ -17,11 +18,12 @@ class Subreddit(RedditObject):
         self.__posts = set()
         self.__posts_next = None
 
-    __subreddit_dict = {}
+    __subreddit_dict = weakref.WeakValueDictionary()
     @classmethod
     def get(cls, name: str):
-        if name in cls.__subreddit_dict:
-            return cls.__subreddit_dict[name]
+        obj = cls.__subreddit_dict.get(name)
+        if obj is not None:
+            return obj
         new_obj = cls(cls.__init_key, name)
         cls.__subreddit_dict[name] = new_obj
         return new_obj
@@ -35,7 +37,7 @@ class Subreddit(RedditObject):
 
     def getUrl(self) -> str:
         """Returns the full url of the subreddit"""
-        return 'https://www.reddit.com/r/' + self.__name
+        return self.base_url + '/r/' + self.__name
 
     def getPostsUrl(self, sort: str = 'top') -> str:
         """Returns the url to retrieve recent posts via sort method (defaults to top)"""
@@ -66,8 +68,7 @@ class Subreddit(RedditObject):
         """Retrieves the posts in this subreddit and saves it to self."""
         return self.retrievePosts()
 
-    def retrievePosts(self, sort: str = 'top', flair: str = None, max_no: int = 100, use_next: bool = False):
-        """Retrieves the posts in this subreddit with custom sorting or flair filtering and saves it to self. Setting use_next to True allows to retrieve new posts for pagination."""
+    def __getRetrievePostsUrl(self, sort: str, flair: str, max_no: int, use_next: bool) -> str:
         if flair:
             u = self.getSearchUrl(json=True, sort=sort, flair=flair, max_no=max_no)
         else:
@@ -75,7 +76,16 @@ class Subreddit(RedditObject):
         if use_next and self.__posts_next:
             u += "&after=" + self.__posts_next
             self.__posts_next = None
-        self._retrieve(u)
+        return u
+
+    def retrievePosts(self, sort: str = 'top', flair: str = None, max_no: int = 100, use_next: bool = False):
+        """Retrieves the posts in this subreddit with custom sorting or flair filtering and saves it to self. Setting use_next to True allows to retrieve new posts for pagination."""
+        self._retrieve(self.__getRetrievePostsUrl(sort, flair, max_no, use_next))
+        return self
+
+    async def retrievePostsAsync(self, sort: str = 'top', flair: str = None, max_no: int = 100, use_next: bool = False):
+        """Retrieves the posts in this subreddit as per retrievePosts, asynchronously."""
+        await self._retrieveAsync(self.__getRetrievePostsUrl(sort, flair, max_no, use_next))
         return self
 
     def hasSubsequentPages(self):
@@ -83,8 +93,12 @@ class Subreddit(RedditObject):
         return self.__posts_next is not None
 
     def getPosts(self):
-        """Returns the posts retrieved from this subreddit."""
+        """Returns the posts retrieved from this subreddit since they were last cleared."""
         return list(self.__posts)
 
+    def clearPosts(self):
+        """Drops the retrieved posts, keeping the pointer to subsequent pages. Posts which aren't referenced elsewhere are freed, e.g. after each page of a long scrape."""
+        self.__posts = set()
+
     def __repr__(self):
         return '[Subreddit ' + self.getFormattedName() + ' <' + str(hex(id(self))) + '>]'
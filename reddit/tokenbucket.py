@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+
+import asyncio
+import threading
+import time
+
+class TokenBucket:
+    """
+    A token bucket rate limiter which can be shared by threads and asyncio tasks alike.
+
+    Tokens are added at rate tokens per second up to capacity, and each request takes a token,
+    waiting until one is available if there are none left. Tokens are reserved when a request starts waiting,
+    so waiting requests are let through in order and the allowed budget is fully used.
+    """
+    def __init__(self, rate: float = 1.0, capacity: float = 1.0):
+        """
+        Creates a full bucket.
+
+        Parameters:
+        - rate: the number of tokens added per second, i.e. the sustained number of requests per second.
+        - capacity: the maximum number of tokens, i.e. the number of requests which may be sent at once after idling.
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.__tokens = capacity
+        self.__updated = time.monotonic()
+        self.__lock = threading.Lock()
+
+    def reserve(self, tokens: float = 1.0) -> float:
+        """Takes the tokens from the bucket, and returns the number of seconds to wait before they may be used."""
+        with self.__lock:
+            now = time.monotonic()
+            self.__tokens = min(self.capacity, self.__tokens + (now - self.__updated)*self.rate)
+            self.__updated = now
+            self.__tokens -= tokens
+            return 0.0 if self.__tokens >= 0 else -self.__tokens/self.rate
+
+    def wait(self, tokens: float = 1.0):
+        """Takes the tokens from the bucket, blocking until they may be used."""
+        delay = self.reserve(tokens)
+        if delay > 0:
+            time.sleep(delay)
+
+    async def acquire(self, tokens: float = 1.0):
+        """Takes the tokens from the bucket, and returns once they may be used without blocking the event loop."""
+        delay = self.reserve(tokens)
+        if delay > 0:
+            await asyncio.sleep(delay)
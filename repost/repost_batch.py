@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+
+import Levenshtein
+import numpy
+from hasher import Hasher, HashStore
+try:
+    from repost_names import NameTable
+except ImportError:
+    from .repost_names import NameTable
+
+#default number of bytes a single block of the (sample x corpus) distance matrix may use
+DEFAULT_MEMORY_BUDGET = 64*1024*1024
+
+#texts are only pruned if their similarity bound is below the threshold by more than this, so rounding can't prune a passing text
+_TEXT_BOUND_EPSILON = 1e-9
+
+#characters are counted in this many buckets by their code point, which is exact for ascii text
+_TEXT_HISTOGRAM_BUCKETS = 128
+
+def getTextHistograms(texts: list):
+    '''
+    Returns a numpy int64 matrix of the character counts of each text, with one row per text.
+
+    Characters are counted by their code point modulo the number of buckets, so non ascii characters may share a bucket.
+    Sharing buckets can only increase the counts in common, so the histograms still give an upper bound for textSimUpperBounds.
+    '''
+    buckets = _TEXT_HISTOGRAM_BUCKETS
+    lengths = numpy.array([len(text) for text in texts], dtype=numpy.int64)
+    codes = numpy.frombuffer(''.join(texts).encode('utf-32-le'), dtype=numpy.uint32) % buckets
+    rows = numpy.repeat(numpy.arange(len(texts), dtype=numpy.int64), lengths)
+    return numpy.bincount(rows*buckets + codes, minlength=len(texts)*buckets).reshape((len(texts), buckets))
+
+def textSimUpperBounds(target_text: str, texts: list):
+    '''
+    Returns a numpy float64 array of upper bounds of Levenshtein.ratio(text, target_text) for each text, which are much cheaper to compute.
+
+    The ratio is 2*LCS/(len1+len2), where LCS is the length of the longest common subsequence.
+    The LCS can't be longer than the shorter text, nor contain more of a character than either text does,
+    so the length bound is computed first, and the character histogram bound only for texts the length bound can't rule out.
+    '''
+    lengths = numpy.array([len(text) for text in texts], dtype=numpy.int64)
+    total = lengths + len(target_text)
+    bounds = numpy.ones(len(texts), dtype=numpy.float64)
+    nonempty = total > 0
+    bounds[nonempty] = 2*numpy.minimum(lengths, len(target_text))[nonempty]/total[nonempty]
+
+    rows = numpy.flatnonzero(bounds > 0.0)
+    if len(rows) and len(target_text):
+        histograms = getTextHistograms([texts[i] for i in rows.tolist()])
+        target_histogram = getTextHistograms([target_text])[0]
+        common = numpy.minimum(histograms, target_histogram).sum(axis=1)
+        bounds[rows] = 2*common/total[rows]
+    return bounds
+
+def findTextSims(target_text: str, texts: list, text_sim_min: float) -> list:
+    '''
+    Computes Levenshtein.ratio between each text and the target text, as far as it matters for the threshold.
+
+    Texts whose ratio can't reach text_sim_min by the length and character histogram bounds are pruned,
+    and only the remaining texts have their exact ratio computed, in one batch.
+
+    Returns:
+    A list of the text similarities, with 0.0 for pruned texts. Whether each similarity is at least text_sim_min
+    is thus always the same as for the exact ratio.
+    '''
+    if text_sim_min <= 0.0 or not texts:
+        return [Levenshtein.ratio(text, target_text) for text in texts]
+    sims = [0.0]*len(texts)
+    survivors = numpy.flatnonzero(textSimUpperBounds(target_text, texts) + _TEXT_BOUND_EPSILON >= text_sim_min)
+    for i in survivors.tolist():
+        sims[i] = Levenshtein.ratio(texts[i], target_text)
+    return sims
+
+def getNameLabels(names: list):
+    '''
+    Parses the given image names into the labels used for deducing detection validity, as per NameTable.getLabels.
+
+    Returns:
+    A tuple of a numpy bool array indicating whether each name is in the standard dataset format, and
+    a numpy int array of group ids, such that names of known same images share the same group id.
+    '''
+    return NameTable().getLabels(names)
+
+def getBlockSize(corpus_size: int, hash_width: int, memory_budget: int = DEFAULT_MEMORY_BUDGET):
+    '''returns the number of samples to compare against the corpus at once within the memory budget'''
+    bytes_per_pair = 2*hash_width + 16
+    return max(1, int(memory_budget // max(1, corpus_size*bytes_per_pair)))
+
+def iterImageDiffBlocks(store: HashStore,
+                        imgs_list: list,
+                        memory_budget: int = DEFAULT_MEMORY_BUDGET):
+    '''
+    Computes the image differences of every image in imgs_list against every image in the store,
+    in blocks of images bounded by the memory budget.
+
+    Yields:
+    A tuple of the list of images in the block, a numpy array of their rows in the store,
+    and a numpy float64 matrix of image differences (one row per image in the block, one column per image in the store),
+    equivalent to Hasher.diff with the IMAGE type.
+    '''
+    matrix = store.getMatrix()
+    mismatched = store.getMismatched()
+    bits = store.getBits()
+
+    #rows are looked up through the store, so single image tasks don't pay for mapping every name
+    block_size = getBlockSize(len(store), matrix.shape[1], memory_budget)
+    for start in range(0, len(imgs_list), block_size):
+        block = imgs_list[start:start+block_size]
+        block_rows = numpy.array([store.getRow(img) for img in block], dtype=numpy.int64)
+        block_hashes = [store[img] for img in block]
+
+        img_diffs = Hasher.countBitDiffsMany(matrix[block_rows], matrix) / (bits or 1)
+        for i, target_hash in enumerate(block_hashes):
+            if len(target_hash)*4 != bits:
+                #hashes of differing lengths are considered completely different
+                img_diffs[i] = 1.0
+        for col, value in mismatched.items():
+            for i, target_hash in enumerate(block_hashes):
+                img_diffs[i, col] = Hasher.diff(value, target_hash, Hasher.Type.IMAGE)
+
+        yield (block, block_rows, img_diffs)
+
+def iterDetectionCounts(store: HashStore,
+                        texts: dict,
+                        imgs_list: list,
+                        img_sim_min: float = 0.8,
+                        text_sim_min: float = 0.7,
+                        memory_budget: int = DEFAULT_MEMORY_BUDGET,
+                        labels: tuple = None):
+    '''
+    Computes the detection validity counts of every image in imgs_list against every image in the store,
+    equivalent to tallying the validity of RepostChecker.checkRepostDetection results for each image.
+
+    The (sample x corpus) image difference matrix is computed in blocks of samples bounded by the memory budget,
+    and text similarities are only computed for pairs which pass the image similarity threshold.
+    The labels of the store's names (as returned by getNameLabels) may be given if they're already known.
+
+    Yields:
+    A tuple of the image name and a dictionary of its TP, FP, TN, FN and ?? counts, for each image in imgs_list in order.
+    '''
+    standard, groups = labels if labels is not None else getNameLabels(store.getNames())
+
+    for block, block_rows, img_diffs in iterImageDiffBlocks(store, imgs_list, memory_budget):
+        is_repost = img_diffs <= 1-img_sim_min
+        is_repost[numpy.arange(len(block)), block_rows] = False
+        if text_sim_min > 0.0:
+            for i in range(len(block)):
+                cols = numpy.flatnonzero(is_repost[i])
+                if len(cols) == 0:
+                    continue
+                text_sims = findTextSims(texts[block[i]], [texts[store.getName(col)] for col in cols.tolist()], text_sim_min)
+                is_repost[i, cols] = numpy.array(text_sims, dtype=numpy.float64) >= text_sim_min
+
+        is_known_same, is_counted = _getBlockLabels(standard, groups, block_rows)
+
+        TP = numpy.count_nonzero(is_counted & is_known_same & is_repost, axis=1)
+        FN = numpy.count_nonzero(is_counted & is_known_same & ~is_repost, axis=1)
+        FP = numpy.count_nonzero(is_counted & ~is_known_same & is_repost, axis=1)
+        TN = numpy.count_nonzero(is_counted & ~is_known_same & ~is_repost, axis=1)
+        unknown = len(store) - 1 - numpy.count_nonzero(is_counted, axis=1)
+
+        for i, img in enumerate(block):
+            yield (img, {'TP': int(TP[i]), 'FP': int(FP[i]), 'TN': int(TN[i]), 'FN': int(FN[i]), '??': int(unknown[i])})
+
+def findDetectionCountsForThresholds(store: HashStore,
+                                     texts: dict,
+                                     imgs_list: list,
+                                     thresholds: list,
+                                     memory_budget: int = DEFAULT_MEMORY_BUDGET,
+                                     labels: tuple = None):
+    '''
+    Computes the total detection validity counts of every image in imgs_list against every image in the store,
+    for every (img_sim_min, text_sim_min) pair in thresholds, in a single pass.
+
+    Image differences and text similarities do not depend on the thresholds, so they are computed once
+    (text similarities only for pairs within the loosest image threshold), and every pair of thresholds
+    is then evaluated by counting over the sorted differences.
+    The labels of the store's names (as returned by getNameLabels) may be given if they're already known.
+
+    Returns:
+    A dictionary mapping each (img_sim_min, text_sim_min) pair to a dictionary of its TP, FP, TN, FN and ?? counts.
+    '''
+    thresholds = list(thresholds)
+    standard, groups = labels if labels is not None else getNameLabels(store.getNames())
+    max_img_diff = max([1-i for i, _ in thresholds], default=-1)
+    needs_text = any(t > 0.0 for _, t in thresholds)
+    #texts which can't reach the loosest positive text threshold don't pass any text threshold their similarity matters for
+    min_text_sim = min([t for _, t in thresholds if t > 0.0], default=0.0)
+
+    totals = {'same': 0, 'other': 0, '??': 0}
+    near = {True: ([], []), False: ([], [])}
+    for block, block_rows, img_diffs in iterImageDiffBlocks(store, imgs_list, memory_budget):
+        is_known_same, is_counted = _getBlockLabels(standard, groups, block_rows)
+        totals['same'] += numpy.count_nonzero(is_counted & is_known_same)
+        totals['other'] += numpy.count_nonzero(is_counted & ~is_known_same)
+        totals['??'] += len(block)*(len(store) - 1) - numpy.count_nonzero(is_counted)
+
+        near_pairs = is_counted & (img_diffs <= max_img_diff)
+        for i in range(len(block)):
+            cols = numpy.flatnonzero(near_pairs[i]).tolist()
+            if not cols:
+                continue
+            if needs_text:
+                text_sims = findTextSims(texts[block[i]], [texts[store.getName(col)] for col in cols], min_text_sim)
+            else:
+                text_sims = [0.0]*len(cols)
+            for col, text_sim in zip(cols, text_sims):
+                diffs, sims = near[bool(is_known_same[i, col])]
+                diffs.append(img_diffs[i, col])
+                sims.append(text_sim)
+
+    #for each text threshold, sorts the image differences of pairs passing it, so each image threshold is a binary search
+    positives = {}
+    for same, (diffs, sims) in near.items():
+        diffs = numpy.array(diffs, dtype=numpy.float64)
+        sims = numpy.array(sims, dtype=numpy.float64)
+        sorted_diffs = {}
+        for i, t in thresholds:
+            if t not in sorted_diffs:
+                sorted_diffs[t] = numpy.sort(diffs[sims >= t])
+            positives[(same, i, t)] = int(numpy.searchsorted(sorted_diffs[t], 1-i, side='right'))
+
+    results = {}
+    for i, t in thresholds:
+        TP = positives[(True, i, t)]
+        FP = positives[(False, i, t)]
+        results[(i, t)] = {'TP': TP,
+                           'FP': FP,
+                           'TN': int(totals['other']) - FP,
+                           'FN': int(totals['same']) - TP,
+                           '??': int(totals['??'])}
+    return results
+
+def addDetectionCounts(vC: dict, other: dict):
+    '''adds the TP, FP, TN, FN and ?? counts of other onto vC, and returns vC'''
+    for validity in ('TP', 'FP', 'TN', 'FN', '??'):
+        vC[validity] += other[validity]
+    return vC
+
+def withDetectionMetrics(vC: dict):
+    '''adds the precision, recall, accuracy and f1 score to the given counts if they can be computed, and returns the counts'''
+    try:
+        precision = round(vC['TP']/(vC['TP'] + vC['FP']),5)
+        recall    = round(vC['TP']/(vC['TP'] + vC['FN']),5)
+        accuracy  = round((vC['TP'] + vC['TN'])/(vC['TP'] + vC['TN'] + vC['FP'] + vC['FN']),5)
+        f1_score  = round(2*vC['TP']/(2*vC['TP'] + vC['FP'] + vC['FN']), 5)
+        vC['precision'] = round(precision, 8)
+        vC['recall']    = round(recall, 8)
+        vC['accuracy']  = round(accuracy, 8)
+        vC['f1_score']  = round(f1_score, 8)
+    except ZeroDivisionError:
+        pass
+    return vC
+
+def _getBlockLabels(standard, groups, block_rows):
+    '''returns whether each pair in the block is known to be the same, and whether it is counted (i.e. standard and not the image itself)'''
+    is_known_same = groups[None, :] == groups[block_rows][:, None]
+    is_counted = numpy.broadcast_to(standard, is_known_same.shape).copy()
+    is_counted[numpy.arange(len(block_rows)), block_rows] = False
+    return (is_known_same, is_counted)
@@ -1,18 +1,129 @@
 #!/usr/bin/env python3
 
+import functools
+import heapq
 import json
+import os
 import random
+from collections import deque
+from multiprocessing import Pool, cpu_count
 from difflib import SequenceMatcher
 import Levenshtein
 from os import listdir
 from os.path import isfile, join
 from PIL import Image, UnidentifiedImageError
 from ocr import OCR
-from hasher import Hasher
+from hasher import Hasher, HashStore, BKTree, MultiIndexHash
 try:
     from repost_maker import generate_bad_repost
+    from repost_store import RepostStore
+    from repost_shared import SharedCorpus
+    from repost_corpus import Corpus, CorpusColumn, LazyDict, writeCorpus
+    from repost_names import NameTable
+    import repost_batch
 except ImportError:
     from .repost_maker import generate_bad_repost
+    from .repost_store import RepostStore
+    from .repost_shared import SharedCorpus
+    from .repost_corpus import Corpus, CorpusColumn, LazyDict, writeCorpus
+    from .repost_names import NameTable
+    from . import repost_batch
+
+_ingestMethods = []
+_ingestKnown = frozenset()
+
+def _initIngestWorker(methods: list, known: frozenset):
+    '''sets the image hashing methods and the digests whose data is already known for this ingestion worker process'''
+    global _ingestMethods, _ingestKnown
+    _ingestMethods = methods
+    _ingestKnown = known
+
+def _ingestImage(path: str):
+    '''
+    decodes, hashes and reads the text of an image in an ingestion worker.
+
+    returns a tuple of the image digest, a dictionary of its hashes keyed by hashing method, and its text,
+    or None if the file isn't an image. the hashes and text are None if the digest's data is already known.
+    '''
+    try:
+        img = Image.open(path)
+        digest = Hasher.digestImage(img)
+    except UnidentifiedImageError:
+        return None
+    if digest in _ingestKnown:
+        #the parent process looks its data up when merging it
+        return (digest, None, None)
+    return (digest, Hasher.hashImageAllMethods(img, _ingestMethods), OCR.read2Normalized(img))
+
+def _getFileKey(path: str):
+    '''returns a key which changes whenever the file is changed, raising FileNotFoundError if it doesn't exist'''
+    stat = os.stat(path)
+    return (path, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+def _getJournalSize(path: str) -> int:
+    '''returns the size of the journal file at the path, or 0 if it doesn't exist'''
+    try:
+        return os.stat(path).st_size
+    except FileNotFoundError:
+        return 0
+
+def _readJournal(path: str, key: tuple, offset: int = 0):
+    '''
+    reads the records appended to the journal file at the path from the given offset, and returns them in a list
+    along with the offset to read from next. a journal which wasn't started for the cache file with the given key
+    (e.g. as the cache was rewritten since) is ignored, and an incomplete last line (e.g. of an interrupted append) is left unread.
+    '''
+    try:
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            data = f.read()
+    except FileNotFoundError:
+        return ([], 0)
+    records = []
+    for line in data.split(b'\n')[:-1]:
+        offset += len(line) + 1
+        record = json.loads(line)
+        if 'journal_of' in record:
+            if record['journal_of'] != list(key[1:]):
+                return ([], 0)
+        else:
+            records.append(record)
+    return (records, offset)
+
+def _applyJournalRecord(x: dict, record: dict, method: str):
+    '''
+    applies a journal record to a dictionary of the contents of a cache, i.e. its image_to_hash (of the given method),
+    image_to_method_hashes, image_to_text and digest_to_data dictionaries.
+    '''
+    if 'digest' in record:
+        x['digest_to_data'].setdefault(record['digest'], {}).update(record['data'])
+        return
+    name = record['image']
+    if record.get('removed'):
+        for k in ('image_to_hash', 'image_to_method_hashes', 'image_to_text'):
+            x[k].pop(name, None)
+        return
+    hashes = record['hashes']
+    if method in hashes:
+        x['image_to_hash'][name] = hashes[method]
+    else:
+        #the image wasn't hashed with the method, so it's unloaded as with other images hashed with another method
+        x['image_to_hash'].pop(name, None)
+    if len(hashes) > 1:
+        x['image_to_method_hashes'][name] = dict(x['image_to_method_hashes'].get(name, {}), **hashes)
+    if 'text' in record:
+        x['image_to_text'][name] = record['text']
+
+def _readJsonCacheFile(path: str, method: str) -> dict:
+    '''returns the contents of the json cache at the path with its journal applied, e.g. to import it into another cache format'''
+    key = _getFileKey(path)
+    with open(path, 'r', encoding='utf-8') as json_data:
+        x = json.load(json_data)
+    for k in ('image_to_hash', 'image_to_method_hashes', 'image_to_text', 'digest_to_data'):
+        x.setdefault(k, {})
+    for record in _readJournal(path + '.journal', key)[0]:
+        _applyJournalRecord(x, record, x.get('image_hash_method', method))
+    return x
 
 class RepostChecker:
     '''
@@ -22,6 +133,11 @@ class RepostChecker:
     - verbose      : Boolean value indicating whether verbose output is printed.
     - use_cache    : Boolean value indicating whether to read from cache if possible.
     - update_cache : Boolean value indicating whether to update the cache.
+    - index_method : The image hash index used to find candidate reposts, i.e. None for a linear scan, 'bktree' or 'mih' (multi-index hashing).
+    - memory_budget: The maximum number of bytes used by a block of image comparisons when finding detection rates.
+    - ocr_pool     : An ocr.OCRPool of long-lived OCR workers to read image text with, or None to read it in this process. Images are read ahead of time by all of its workers when processing several.
+    - commit_every : The number of images processed between incremental commits when using a SQLite cache.
+    - all_hash_methods: Boolean value indicating whether images are hashed with every image hashing method when processed, so the method can be switched via setImageHashMethod without recomputing.
     '''
 
     def __init__(self, img_dir: str, imagehash_method = 'dHash'):
@@ -38,32 +154,525 @@ class RepostChecker:
         self.__cache_json_path = join(img_dir, '__repost_check_data__.json')
         self.use_cache = True
         self.update_cache = True
+        self.index_method = None
+        self.memory_budget = repost_batch.DEFAULT_MEMORY_BUDGET
+        self.ocr_pool = None
+        self.commit_every = 100
+        self.all_hash_methods = False
+        self.__store_path = None
+        self.__store = None
+        self.__corpus_path = None
+        self.__corpus = None
+        self.__loadedCacheKey = None
+        self.__dirtyImages = {}
+        self.__dirtyDigests = {}
         self.__imageToHash = {}
+        self.__imageToMethodHashes = {}
         self.__imageToText = {}
+        self.__digestToData = {}
+        self.__digestNames = None
+        self.__readingDigests = {}
+        self.__hashStore = None
+        self.__imageIndex = None
+        self.__imageIndexMethod = None
+        self.__nameTable = NameTable()
+
+    def __getstate__(self):
+        '''the OCR pool is left out when pickling, e.g. when sending this checker to other processes'''
+        state = self.__dict__.copy()
+        state['ocr_pool'] = None
+        state['_RepostChecker__store'] = None
+        state['_RepostChecker__readingDigests'] = {}
+        return state
 
     def vPrint(self,x=''):
         if self.verbose:
             print(x)
 
     def readProcessedDataFromCache(self):
+        '''
+        Loads the processed data from the cache.
+
+        The cache is only read again if it has changed since it was last loaded and nothing was changed in memory since.
+        For a SQLite cache, only the rows written since then are loaded, unless images have been removed from it.
+        '''
+        if self.__store_path is not None:
+            if self.use_cache:
+                store = self.__getStore()
+                seq, removed = store.getGeneration()
+                loaded = self.__loadedCacheKey
+                if loaded is not None and loaded[0] == self.__store_path and loaded[2] == removed and \
+                   not self.__dirtyImages and not self.__dirtyDigests:
+                    if loaded[1] != seq:
+                        self.__readStoreChanges(store, loaded[1])
+                else:
+                    self.__imageToHash = store.readImageHashes(self.__getMethodName())
+                    self.__imageToMethodHashes = {name: hashes for name, hashes in store.readImageMethodHashes().items() if len(hashes) > 1}
+                    self.__imageToText = store.readImageTexts()
+                    self.__digestToData = store.readDigestData()
+                    self.__digestNames = None
+                    self.__hashStore = None
+                    self.__imageIndex = None
+                    self.__dirtyImages = {}
+                    self.__dirtyDigests = {}
+                self.__loadedCacheKey = (self.__store_path, seq, removed)
+            return
+
+        if self.__corpus_path is not None:
+            if self.use_cache and isfile(self.__corpus_path):
+                key = _getFileKey(self.__corpus_path)
+                loaded = self.__loadedCacheKey
+                if loaded is not None and loaded[0] == key and not self.__dirtyImages and not self.__dirtyDigests:
+                    #only the records appended to the journal since it was loaded are read
+                    self.__loadedCacheKey = (key, self.__readJournalChanges(self.__corpus_path, key, loaded[1]))
+                    return
+                #nothing is parsed here, hashes and texts are read from the memory mapped corpus when used
+                corpus = Corpus(self.__corpus_path)
+                self.__corpus = corpus
+                self.__imageToHash = CorpusColumn(corpus, 'hash')
+                self.__imageToText = CorpusColumn(corpus, 'text')
+                self.__imageToMethodHashes = LazyDict(functools.partial(corpus.getExtraItem, 'image_to_method_hashes'))
+                self.__digestToData = LazyDict(functools.partial(corpus.getExtraItem, 'digest_to_data'))
+                self.__digestNames = None
+                self.__hashStore = None
+                self.__imageIndex = None
+                self.__dirtyImages = {}
+                self.__dirtyDigests = {}
+                if corpus.getMethod() != self.__getMethodName():
+                    self.__selectMethodHashes(keep_unknown=False)
+                self.__loadedCacheKey = (key, self.__readJournalChanges(self.__corpus_path, key, 0))
+            return
+
         try:
             if self.use_cache:
+                key = _getFileKey(self.__cache_json_path)
+                loaded = self.__loadedCacheKey
+                if loaded is not None and loaded[0] == key and not self.__dirtyImages and not self.__dirtyDigests:
+                    #only the records appended to the journal since it was loaded are read
+                    self.__loadedCacheKey = (key, self.__readJournalChanges(self.__cache_json_path, key, loaded[1]))
+                    return
                 with open(self.__cache_json_path, 'r', encoding='utf-8') as json_data:
                     x = json.load(json_data)
-                    if 'image_to_hash' in x:
-                        self.__imageToHash = x['image_to_hash']
-                    if 'image_to_text' in x:
-                        self.__imageToText = x['image_to_text']
-                    if 'image_to_text_hash' in x:
-                        self.__imageToTextHash = x['image_to_text_hash']
+                self.__dirtyImages = {}
+                self.__dirtyDigests = {}
+                if 'image_to_hash' in x:
+                    self.__imageToHash = x['image_to_hash']
+                    self.__hashStore = None
+                    self.__imageIndex = None
+                if 'image_to_method_hashes' in x:
+                    self.__imageToMethodHashes = x['image_to_method_hashes']
+                if 'image_to_method_hashes' in x or 'image_hash_method' in x:
+                    #hashes of images hashed with another method than the current one are unloaded
+                    self.__selectMethodHashes(keep_unknown=x.get('image_hash_method', self.__getMethodName()) == self.__getMethodName())
+                if 'image_to_text' in x:
+                    self.__imageToText = x['image_to_text']
+                if 'image_to_text_hash' in x:
+                    self.__imageToTextHash = x['image_to_text_hash']
+                if 'digest_to_data' in x:
+                    self.__digestToData = x['digest_to_data']
+                    self.__digestNames = None
+                self.__loadedCacheKey = (key, self.__readJournalChanges(self.__cache_json_path, key, 0))
         except FileNotFoundError:
             pass
 
+    def __readJournalChanges(self, cache_path: str, key: tuple, offset: int) -> int:
+        '''
+        loads the records appended to the journal of the JSON or corpus cache at the path from the given offset on top of the loaded data,
+        and returns the offset to read from next.
+        '''
+        records, offset = _readJournal(cache_path + '.journal', key, offset)
+        x = {'image_to_hash': self.__imageToHash, 'image_to_method_hashes': self.__imageToMethodHashes,
+             'image_to_text': self.__imageToText, 'digest_to_data': self.__digestToData}
+        for record in records:
+            _applyJournalRecord(x, record, self.__getMethodName())
+            if 'image' not in record:
+                continue
+            name = record['image']
+            for index in (self.__hashStore, self.__imageIndex):
+                if index is not None and name in self.__imageToHash:
+                    index.add(name, self.__imageToHash[name])
+                elif index is not None:
+                    index.remove(name)
+        if records:
+            self.__digestNames = None
+        return offset
+
+    def __isLoadedCache(self, cache_path: str) -> bool:
+        '''returns whether the JSON or corpus cache at the path and its journal are unchanged since they were loaded or saved'''
+        try:
+            key = _getFileKey(cache_path)
+        except FileNotFoundError:
+            return False
+        return self.__loadedCacheKey == (key, _getJournalSize(cache_path + '.journal'))
+
+    def __appendToJournal(self, cache_path: str) -> bool:
+        '''
+        appends the images and digests changed since the last save to the journal of the JSON or corpus cache at the path,
+        so saving costs as much as the data changed rather than rewriting the cache.
+
+        they're only appended if the cache and its journal are the ones loaded, and the journal is still smaller than the cache,
+        so the cache is rewritten (and its journal dropped) once as much was appended as it holds.
+        returns whether they were appended, otherwise the cache should be rewritten.
+        '''
+        if not self.__dirtyImages and not self.__dirtyDigests:
+            return False
+        journal_path = cache_path + '.journal'
+        try:
+            key = _getFileKey(cache_path)
+        except FileNotFoundError:
+            return False
+        size = _getJournalSize(journal_path)
+        if self.__loadedCacheKey != (key, size) or size >= key[2]:
+            return False
+
+        method = self.__getMethodName()
+        records = [{'journal_of': list(key[1:])}] if size == 0 else []
+        for name in self.__dirtyImages:
+            if name in self.__imageToHash or name in self.__imageToText:
+                record = {'image': name, 'hashes': dict(self.__imageToMethodHashes.get(name, {}))}
+                if name in self.__imageToHash:
+                    record['hashes'][method] = self.__imageToHash[name]
+                if name in self.__imageToText:
+                    record['text'] = self.__imageToText[name]
+            else:
+                record = {'image': name, 'removed': True}
+            records.append(record)
+        for digest in self.__dirtyDigests:
+            records.append({'digest': digest, 'data': self.__digestToData.get(digest, {})})
+        data = ''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in records).encode('utf-8')
+        with open(journal_path, 'ab') as f:
+            f.write(data)
+        self.__loadedCacheKey = (key, size + len(data))
+        return True
+
+    def __dropJournal(self, cache_path: str):
+        '''removes the journal of the cache at the path once the cache was rewritten, as it's applied to it'''
+        if isfile(cache_path + '.journal'):
+            os.remove(cache_path + '.journal')
+
+    def __readStoreChanges(self, store, since: int):
+        '''loads the rows of the SQLite store written after the given generation on top of the loaded data'''
+        for name, img_hash in store.readImageHashes(self.__getMethodName(), since).items():
+            self.__imageToHash[name] = img_hash
+            if self.__hashStore is not None:
+                self.__hashStore.add(name, img_hash)
+            if self.__imageIndex is not None:
+                self.__imageIndex.add(name, img_hash)
+        for name, method_hashes in store.readImageMethodHashes(since).items():
+            method_hashes = dict(self.__imageToMethodHashes.get(name, {}), **method_hashes)
+            if len(method_hashes) > 1:
+                self.__imageToMethodHashes[name] = method_hashes
+        self.__imageToText.update(store.readImageTexts(since))
+        for digest, data in store.readDigestData(since).items():
+            self.__digestToData.setdefault(digest, {}).update(data)
+        self.__digestNames = None
+
+    def __getMethodName(self):
+        '''returns the raw value of the image hashing method'''
+        method = self.__imagehash_method
+        return method.value if isinstance(method, Hasher.ImageHashMethod) else method
+
+    def __getMethodNames(self):
+        '''returns the raw values of the image hashing methods images are hashed with when processed'''
+        method = self.__getMethodName()
+        if not self.all_hash_methods:
+            return [method]
+        methods = [m.value for m in Hasher.ImageHashMethod]
+        return methods if method in methods else methods + [method]
+
+    def getImageHashMethod(self):
+        return self.__imagehash_method
+
+    def setImageHashMethod(self, imagehash_method):
+        '''
+        Switches the image hashing method of the loaded images to the given one, without recomputing any hashes.
+
+        Images which weren't hashed with that method (i.e. processed without all_hash_methods) are unloaded,
+        so that the next processData call only recomputes their hashes. Their texts are kept.
+
+        Returns:
+        The number of images which were unloaded.
+        '''
+        self.__imagehash_method = imagehash_method
+        return self.__selectMethodHashes(keep_unknown=False)
+
+    def __selectMethodHashes(self, keep_unknown: bool):
+        '''
+        sets the loaded image hashes to those of the current image hashing method, and returns the number of images unloaded
+        as they weren't hashed with it. images without hashes of other methods are kept if keep_unknown is True.
+        '''
+        method = self.__getMethodName()
+        d = {}
+        for name, img_hash in self.__imageToHash.items():
+            method_hashes = self.__imageToMethodHashes.get(name)
+            if method_hashes is None:
+                if keep_unknown:
+                    d[name] = img_hash
+            elif method in method_hashes:
+                d[name] = method_hashes[method]
+        unloaded = len(self.__imageToHash) - len(d)
+        self.__imageToHash = d
+        self.__hashStore = None
+        self.__imageIndex = None
+        return unloaded
+
+    def __getStore(self):
+        '''returns the SQLite store used as the cache, opening it if necessary'''
+        if self.__store is None:
+            self.__store = RepostStore(self.__store_path)
+        return self.__store
+
+    def __getDigestNames(self):
+        '''returns a dictionary mapping the canonical image of each digest to the digest, building it if necessary'''
+        if self.__digestNames is None:
+            self.__digestNames = {data['name']: digest for digest, data in self.__digestToData.items() if data.get('name')}
+        return self.__digestNames
+
+    def __getDigestText(self, data: dict):
+        '''returns the text of a digest cache entry, i.e. the text of its canonical image, or None if it isn't loaded'''
+        name = data.get('name')
+        if name and name in self.__imageToText:
+            return self.__imageToText[name]
+        return None
+
+    def __unsetDigestName(self, name: str):
+        '''unsets the image as the canonical image of its digest, e.g. as it was removed or its file was changed'''
+        digest = self.__getDigestNames().pop(name, None)
+        data = self.__digestToData.get(digest) if digest is not None else None
+        if data is not None and data.get('name') == name:
+            #the name is emptied rather than removed, so saving it to the SQLite store overwrites it
+            data['name'] = ''
+            self.__dirtyDigests[digest] = None
+
+    def __beginImageData(self, img, name: str, source=None, recheck: bool = False, read: bool = True):
+        '''
+        starts computing the hash and OCR text of an image with the given name, returning a handle to pass to __finishImageData.
+
+        with an OCR pool, the text is read by a worker in the background, so several images can be read at once.
+        the worker is sent the source if given (e.g. the image's filename, which is cheaper to send), or the image otherwise.
+
+        hashes are cached by a digest of the image's pixels, along with the name of the image they were computed from,
+        whose text is used as the text of the digest. so identical images are only hashed and read once, even if they
+        are saved under different names. if recheck is True, the cache isn't used.
+        if read is False, a text which isn't cached is left as None for the caller to read.
+        '''
+        methods = self.__getMethodNames()
+
+        digest = Hasher.digestImage(img)
+        if read and not recheck and digest in self.__readingDigests:
+            #an identical image is already being read
+            data, reading = self.__readingDigests[digest]
+            return (name, digest, data, None, reading)
+        cached = {} if recheck else self.__digestToData.get(digest, {})
+        text = self.__getDigestText(cached)
+        data = {key: value for key, value in cached.items() if key != 'name' or text is not None}
+        missing = [m for m in methods if m not in data]
+        if missing:
+            data.update(Hasher.hashImageAllMethods(img, missing))
+        reading = None
+        if text is None and read:
+            if self.ocr_pool is not None:
+                reading = self.ocr_pool.read2Async(source if source is not None else img, normalized=True)
+                if not recheck:
+                    self.__readingDigests[digest] = (data, reading)
+            else:
+                text = OCR.read2Normalized(img)
+        return (name, digest, data, text, reading)
+
+    def __finishImageData(self, handle):
+        '''
+        waits for the image data started by __beginImageData, and returns the hash and OCR text of the image in a tuple
+        along with a dictionary of its hashes keyed by hashing method if all_hash_methods is set, or None otherwise.
+
+        the image becomes the canonical image of its digest if its text was read from it, so the text should be set right after.
+        '''
+        name, digest, data, text, reading = handle
+        if reading is not None:
+            text = reading.get()
+            if self.__readingDigests.get(digest, (None, None))[1] is reading:
+                del self.__readingDigests[digest]
+        names = self.__getDigestNames()
+        if names.get(name, digest) != digest:
+            #the image was changed, so its previous digest's text is no longer the text of its canonical image
+            self.__unsetDigestName(name)
+        if not data.get('name'):
+            canonical = self.__digestToData.get(digest, {}).get('name')
+            if canonical and names.get(canonical) == digest:
+                del names[canonical]
+            data['name'] = name
+            names[name] = digest
+        self.__digestToData[digest] = data
+        self.__dirtyDigests[digest] = None
+        method_hashes = {m: data[m] for m in self.__getMethodNames()} if self.all_hash_methods else None
+        return (data[self.__getMethodName()], text, method_hashes)
+
+    def __readImageText(self, img) -> str:
+        '''reads the normalized OCR text of an image, using the OCR pool if one is given'''
+        if self.ocr_pool is not None:
+            return self.ocr_pool.read2Normalized(img)
+        return OCR.read2Normalized(img)
+
+    def __computeImageData(self, img, name: str, recheck: bool = False):
+        '''computes the hash and OCR text of an image as per __beginImageData and __finishImageData'''
+        return self.__finishImageData(self.__beginImageData(img, name, recheck=recheck))
+
+    def __getReadAhead(self):
+        '''returns the number of images whose texts are read at once, i.e. twice the number of OCR pool workers, or 1 without a pool'''
+        return self.ocr_pool.workers*2 if self.ocr_pool is not None else 1
+
+    def __finishImagesData(self, in_flight: deque, limit: int = 0):
+        '''
+        sets the data of the oldest handles of images in flight until fewer than limit are left (all of them by default),
+        saving a checkpoint every commit_every images with a SQLite cache.
+        '''
+        while in_flight and len(in_flight) >= limit:
+            handle = in_flight.popleft()
+            self.__setImageData(handle[0], *self.__finishImageData(handle))
+            if self.__store_path is not None and len(self.__dirtyImages) >= self.commit_every:
+                self.saveProcessedDataToCache()
+
+    def __getHashStore(self):
+        '''returns the array-backed store of all image hashes, building it if necessary'''
+        if self.__hashStore is None and isinstance(self.__imageToHash, CorpusColumn):
+            self.__hashStore = self.__imageToHash.toHashStore()
+        elif self.__hashStore is None:
+            self.__hashStore = HashStore(self.__imageToHash)
+        return self.__hashStore
+
+    def __getImageIndex(self):
+        '''returns the image hash index for the current index_method, building it if necessary'''
+        if self.__imageIndex is None or self.__imageIndexMethod != self.index_method:
+            if self.index_method == 'bktree':
+                self.__imageIndex = BKTree(self.__imageToHash)
+            elif self.index_method == 'mih':
+                self.__imageIndex = MultiIndexHash(self.__imageToHash)
+            else:
+                raise ValueError('An unexpected index method ' + str(self.index_method) + ' was given')
+            self.__imageIndexMethod = self.index_method
+        return self.__imageIndex
+
+    def __setImageData(self, name: str, img_hash: str, text: str, method_hashes: dict = None):
+        '''sets the hash (and optionally the hashes of other methods) and text of an image, keeping all in-memory structures in sync'''
+        self.__imageToHash[name] = img_hash
+        if method_hashes:
+            self.__imageToMethodHashes.setdefault(name, {}).update(method_hashes)
+        elif name in self.__imageToMethodHashes:
+            self.__imageToMethodHashes[name][self.__getMethodName()] = img_hash
+        self.__imageToText[name] = text
+        self.__dirtyImages[name] = None
+        if self.__hashStore is not None:
+            self.__hashStore.add(name, img_hash)
+        if self.__imageIndex is not None:
+            self.__imageIndex.add(name, img_hash)
+
+    def __removeImageData(self, name: str):
+        '''removes the hash and text of an image from all in-memory structures, if present'''
+        if name in self.__imageToText:
+            self.__unsetDigestName(name)
+        if name in self.__imageToHash:
+            del self.__imageToHash[name]
+        if name in self.__imageToMethodHashes:
+            del self.__imageToMethodHashes[name]
+        if name in self.__imageToText:
+            del self.__imageToText[name]
+        self.__dirtyImages[name] = None
+        if self.__hashStore is not None:
+            self.__hashStore.remove(name)
+        if self.__imageIndex is not None:
+            self.__imageIndex.remove(name)
+
+    def createSharedCorpus(self):
+        '''
+        Places the hashes and texts of all loaded images into shared memory, e.g. for worker processes to attach to.
+
+        Returns:
+        A SharedCorpus, which should be closed once it's no longer needed to free the shared memory.
+        '''
+        return SharedCorpus.create(self.__getHashStore(), self.__imageToText)
+
+    def buildImageIndex(self):
+        '''
+        Builds the image hash index for the current index_method (or the hash store scanned without one) if it isn't built yet,
+        so the first query doesn't have to, e.g. when starting a long-running service.
+        '''
+        if self.index_method is None:
+            self.__getHashStore()
+        else:
+            self.__getImageIndex()
+
+    def findSimilarImages(self, img_hash: str, img_sim_min: float = 0.8):
+        '''
+        Finds all loaded images whose image hash similarity to the given hash is at least img_sim_min,
+        using the image hash index given by index_method, or a linear scan if it is None.
+
+        Returns:
+        A list of (image name, image difference) tuples in the order the images were loaded.
+        '''
+        if self.index_method is None:
+            return self.__getHashStore().query(img_hash, 1-img_sim_min)
+        return self.__getImageIndex().query(img_hash, 1-img_sim_min)
+
     def saveProcessedDataToCache(self):
-        if self.update_cache:
-            output = {'image_to_hash': self.__imageToHash, 'image_to_text': self.__imageToText}
-            with open(self.__cache_json_path, 'w', encoding='utf-8') as f:
-                json.dump(output, f, indent=4, ensure_ascii=False)
+        '''
+        Saves the processed data to the cache if update_cache is set.
+
+        Only the images and digests changed since the last save are written: rows of a SQLite cache are upserted,
+        and with a JSON or corpus cache, they're appended to a journal next to it (e.g. __repost_check_data__.json.journal)
+        which is merged when the cache is loaded. The cache is only rewritten as a whole, dropping its journal,
+        once the journal is as large as the cache, or if it was changed elsewhere since it was loaded.
+        Nothing is written if nothing was changed since the cache was loaded or saved.
+        '''
+        if self.update_cache and self.__store_path is not None:
+            #only images and digests changed since the last save are written, in the order they were changed
+            store = self.__getStore()
+            method = self.__getMethodName()
+            #the rows written here don't need to be read back, unless the store was also changed elsewhere since it was loaded
+            in_sync = self.__loadedCacheKey == (self.__store_path,) + store.getGeneration()
+            for name in self.__dirtyImages:
+                if name in self.__imageToHash or name in self.__imageToText:
+                    for other_method, img_hash in self.__imageToMethodHashes.get(name, {}).items():
+                        store.setImageHash(name, other_method, img_hash)
+                    if name in self.__imageToHash:
+                        store.setImageHash(name, method, self.__imageToHash[name])
+                    if name in self.__imageToText:
+                        store.setImageText(name, self.__imageToText[name])
+                else:
+                    store.removeImage(name)
+            for digest in self.__dirtyDigests:
+                for key, value in self.__digestToData.get(digest, {}).items():
+                    store.setDigestData(digest, key, value)
+            store.commit()
+            if in_sync:
+                self.__loadedCacheKey = (self.__store_path,) + store.getGeneration()
+            self.__dirtyImages = {}
+            self.__dirtyDigests = {}
+        elif self.update_cache and self.__corpus_path is not None:
+            if (self.__dirtyImages or self.__dirtyDigests or not isfile(self.__corpus_path)) and \
+               not self.__appendToJournal(self.__corpus_path):
+                extra = None
+                if isinstance(self.__digestToData, LazyDict) and not self.__digestToData.isLoaded() and \
+                   isinstance(self.__imageToMethodHashes, LazyDict) and not self.__imageToMethodHashes.isLoaded():
+                    #the extra data wasn't used, so it's copied over without parsing it
+                    extra = self.__corpus.getExtraBytes()
+                else:
+                    extra = json.dumps({'image_to_method_hashes': dict(self.__imageToMethodHashes),
+                                        'digest_to_data': dict(self.__digestToData)}, ensure_ascii=False).encode('utf-8')
+                writeCorpus(self.__corpus_path, self.__imageToHash, self.__imageToText, self.__getMethodName(), extra)
+                self.__dropJournal(self.__corpus_path)
+                self.__loadedCacheKey = (_getFileKey(self.__corpus_path), 0)
+            self.__dirtyImages = {}
+            self.__dirtyDigests = {}
+        elif self.update_cache:
+            if (self.__dirtyImages or self.__dirtyDigests or not self.__isLoadedCache(self.__cache_json_path)) and \
+               not self.__appendToJournal(self.__cache_json_path):
+                output = {'image_hash_method': self.__getMethodName(), 'image_to_hash': self.__imageToHash, 'image_to_method_hashes': self.__imageToMethodHashes,
+                          'image_to_text': self.__imageToText, 'digest_to_data': self.__digestToData}
+                with open(self.__cache_json_path, 'w', encoding='utf-8') as f:
+                    json.dump(output, f, indent=4, ensure_ascii=False)
+                self.__dropJournal(self.__cache_json_path)
+                self.__loadedCacheKey = (_getFileKey(self.__cache_json_path), 0)
+            self.__dirtyImages = {}
+            self.__dirtyDigests = {}
 
     def getCacheJsonPath(self):
         return self.__cache_json_path
@@ -71,7 +680,55 @@ class RepostChecker:
     def setJsonCacheFilenmaeTarget(self, filename='__repost_check_data__.json'):
         self.__cache_json_path = join(self.img_dir, filename)
 
-    def processData(self, only_cached_files=False, max_capacity=None):
+    def setSqliteCacheFilenameTarget(self, filename='__repost_check_data__.sqlite3', import_json=True):
+        '''
+        Uses a SQLite database in the image directory as the cache instead of the JSON file.
+        Saving then only writes images changed since the last save, and processData commits incrementally.
+
+        If import_json is True and the database has no images yet, the current JSON cache (if any) is imported into it once.
+        '''
+        if self.__store is not None:
+            self.__store.close()
+            self.__store = None
+        self.__corpus_path = None
+        self.__store_path = join(self.img_dir, filename)
+        store = self.__getStore()
+        if import_json and store.isEmpty() and isfile(self.__cache_json_path):
+            count = store.importData(_readJsonCacheFile(self.__cache_json_path, self.__getMethodName()), self.__getMethodName())
+            self.vPrint('imported %d items from %s' % (count, self.__cache_json_path))
+
+    def getCacheSqlitePath(self):
+        return self.__store_path
+
+    def setCorpusFilenameTarget(self, filename='__repost_check_data__.corpus', import_json=True):
+        '''
+        Uses a memory mapped binary corpus in the image directory as the cache instead of the JSON file.
+        Reading the cache then doesn't parse anything, so queries can be answered immediately,
+        and processes reading the same corpus share it in the page cache. Saving appends the changed images to a journal
+        next to the corpus, which is merged on load, and only rewrites the corpus once the journal is as large as it.
+
+        If import_json is True and the corpus doesn't exist yet, it's created from the current JSON cache (if any).
+        '''
+        if self.__store is not None:
+            self.__store.close()
+            self.__store = None
+        self.__store_path = None
+        self.__corpus_path = join(self.img_dir, filename)
+        if import_json and not isfile(self.__corpus_path) and isfile(self.__cache_json_path):
+            x = _readJsonCacheFile(self.__cache_json_path, self.__getMethodName())
+            extra = json.dumps({'image_to_method_hashes': x.get('image_to_method_hashes', {}),
+                                'digest_to_data': x.get('digest_to_data', {})}, ensure_ascii=False).encode('utf-8')
+            writeCorpus(self.__corpus_path,
+                        x.get('image_to_hash', {}),
+                        x.get('image_to_text', {}),
+                        x.get('image_hash_method', self.__getMethodName()),
+                        extra)
+            self.vPrint('imported %d items from %s' % (len(x.get('image_to_hash', {})), self.__cache_json_path))
+
+    def getCacheCorpusPath(self):
+        return self.__corpus_path
+
+    def processData(self, only_cached_files=False, max_capacity=None, workers=None):
         '''
         Processes all posts and returns two dictionaries in a tuple.
         The first maps image name to hash, and
@@ -80,6 +737,10 @@ class RepostChecker:
         The results will also be cached in memory within the class and
         will be used in other methods for checking reposts
 
+        If workers is more than 1, images are decoded, hashed and read by that many worker processes
+        (0 uses all cpus), with a bounded number of images in flight. Results are merged in file order,
+        so they are the same as processing sequentially.
+
         Returns:
         A tuple of two dictionaries, first one containing image name to hash mappings
         and second one containing image name to OCR readings.
@@ -101,6 +762,15 @@ class RepostChecker:
         t = self.__imageToText
 
         self.vPrint("loading... " + str(len(files)) + ' items')
+        if workers is not None and (workers == 0 or workers > 1):
+            self.__processFilesParallel([file for file in files if file not in d or file not in t], workers if workers else cpu_count())
+            self.vPrint('loaded: ' + str(len(d.items())) + ' items')
+            self.saveProcessedDataToCache()
+            return (d,t)
+
+        #with an OCR pool, the texts of the next images are read by its workers while earlier ones are merged
+        read_ahead = self.__getReadAhead()
+        in_flight = deque()
         for i, file in enumerate(files):
             if len(files) < 50 or i % (len(files)//20) == 0:
                 self.vPrint('partial: %5d/%d' % (i,len(files)))
@@ -108,100 +778,318 @@ class RepostChecker:
             try:
                 if file not in d or file not in t:
                     img = Image.open(join(self.img_dir, file))
-                    d[file] = Hasher.hashImage(img, self.__imagehash_method)
-                    t[file] = OCR.read2Normalized(img)
+                    in_flight.append(self.__beginImageData(img, file, join(self.img_dir, file)))
+                self.__finishImagesData(in_flight, read_ahead)
             except KeyboardInterrupt:
                 self.vPrint('skipped remaining files')
-                if file in d:
-                    del d[file]
-                if file in t:
-                    del t[file]
+                self.__removeImageData(file)
+                in_flight.clear()
+                self.__readingDigests.clear()
                 break
             except UnidentifiedImageError:
                 self.vPrint('skipped ' + file + ' (not an image)')
-                if file in d:
-                    del d[file]
-                if file in t:
-                    del t[file]
+                self.__removeImageData(file)
+        self.__finishImagesData(in_flight)
 
         self.vPrint('loaded: ' + str(len(d.items())) + ' items')
-        self.__imageToHash = d
-        self.__imageToText = t
         self.saveProcessedDataToCache()
         return (d,t)
 
+    def __processFilesParallel(self, files: list, workers: int):
+        '''
+        processes the files across a pool of worker processes.
 
-    def checkRepostDetection(self,
-                             img: str,
-                             img_sim_min: int = 0.8,
-                             text_sim_min: float = 0.7,
-                             recheck_img: bool = True,
-                             generate_repost: bool = False,
-                             save_generated_repost: bool = True):
+        at most twice as many images as workers are in flight at once, and results are merged as soon as
+        the oldest one in flight is done, so memory use stays bounded and the merge order follows the file order.
         '''
-        Checks whether reposts can be detected correctly using
-        a naive algorithm considering image hashes and ocr text.
+        methods = self.__getMethodNames()
+        #only digests are sent to the workers, as their hashes and texts are looked up when merging
+        known = frozenset(digest for digest, data in self.__digestToData.items() \
+                          if all(m in data for m in methods) and self.__getDigestText(data) is not None)
+        pending = files
+
+        in_flight = deque()
+        pool = Pool(workers, initializer=_initIngestWorker, initargs=(methods, known))
+        try:
+            for i, file in enumerate(pending):
+                in_flight.append((file, pool.apply_async(_ingestImage, (join(self.img_dir, file),))))
+                while len(in_flight) >= workers*2 or (in_flight and i == len(pending)-1):
+                    self.__mergeIngested(*in_flight.popleft())
+                    done = i + 1 - len(in_flight)
+                    if len(pending) < 50 or done % max(1, len(pending)//20) == 0:
+                        self.vPrint('partial: %5d/%d' % (done, len(pending)))
+        except KeyboardInterrupt:
+            self.vPrint('skipped remaining files')
+        finally:
+            #all results were merged unless processing was interrupted or failed, in which case the rest are dropped
+            pool.terminate()
+            pool.join()
+
+    def __mergeIngested(self, file: str, result):
+        '''merges the result of an ingestion worker for the given file, saving a checkpoint if necessary'''
+        ingested = result.get()
+        if ingested is None:
+            self.vPrint('skipped ' + file + ' (not an image)')
+            self.__removeImageData(file)
+            return
+        digest, method_hashes, text = ingested
+        cached = self.__digestToData.get(digest, {})
+        if method_hashes is None:
+            text = self.__getDigestText(cached)
+            if text is None or any(m not in cached for m in self.__getMethodNames()):
+                #the known data was removed meanwhile, so the image is processed here instead
+                self.__setImageData(file, *self.__computeImageData(Image.open(join(self.img_dir, file)), file))
+            else:
+                self.__setImageData(file, *self.__finishImageData((file, digest, dict(cached), text, None)))
+        else:
+            data = dict(cached, **method_hashes)
+            if self.__getDigestText(cached) is None:
+                data.pop('name', None)
+            self.__setImageData(file, *self.__finishImageData((file, digest, data, text, None)))
+        if self.__store_path is not None and len(self.__dirtyImages) >= self.commit_every:
+            self.saveProcessedDataToCache()
 
-        This assumes the dataset is correctly labelled such that
-        a reposted image is the image name prefixed with _REPOST_.
+    def addImage(self, img: str, save: bool = True, image: Image = None):
+        '''
+        Adds an image in the image directory to the loaded images, e.g. a newly scraped post, without processing
+        or reloading any other images. It's hashed and read, and inserted into the hash store and image index in place.
+        An image which is already loaded is processed again.
 
-        If an image is custom crafted and you don't want it to
-        make a deduction of whether it's a true positive or otherwise,
-        simply avoid using the standard format name of:
-            <subreddit>_<postID>.<imgExtension>
+        The cache should be loaded beforehand (i.e. via readProcessedDataFromCache or processData), as saving writes to it.
+        Saving only appends the new image to the cache, i.e. its rows with a SQLite cache, or a record to the journal of a JSON
+        or corpus cache, which is rewritten once its journal is as large as it (see saveProcessedDataToCache).
+
+        Parameters:
+        - img  : the filename of the image in the image directory.
+        - save : whether to save the changes to the cache if update_cache is set, otherwise they're saved with the next save.
+        - image: the PIL image of the file if it's already decoded (e.g. while it was downloaded), so it isn't decoded again.
+
+        Returns:
+        A tuple of the image hash and OCR text of the image, or None if the file isn't an image.
+        '''
+        try:
+            img_hash, img_text, method_hashes = self.__computeImageData(image if image is not None else Image.open(join(self.img_dir, img)), img)
+        except UnidentifiedImageError:
+            self.vPrint('skipped ' + img + ' (not an image)')
+            return None
+        self.__setImageData(img, img_hash, img_text, method_hashes)
+        if save:
+            self.saveProcessedDataToCache()
+        return (img_hash, img_text)
+
+    def addImageUnlessRepost(self, img: str, img_sim_min: float = 0.8, text_sim_min: float = 0.7, save: bool = True, image: Image = None):
+        '''
+        Adds an image in the image directory to the loaded images as per addImage, unless it's a repost of a loaded image
+        as per findReposts, i.e. with the same thresholds as checkRepostDetection, e.g. to reject reposts while scraping.
+
+        The image is hashed once, and its text is only read if it's needed, i.e. if it's added, or if it has candidates by
+        image similarity and isn't an exact duplicate of a loaded image (whose text is used instead, via the digest cache).
+
+        Returns:
+        A tuple of whether the image was added, and a list of the reposts found as per findReposts (empty if it was added),
+        or None if the file isn't an image.
+        '''
+        try:
+            if image is None:
+                image = Image.open(join(self.img_dir, img))
+            name, digest, data, text, _ = self.__beginImageData(image, img, read=False)
+        except UnidentifiedImageError:
+            self.vPrint('skipped ' + img + ' (not an image)')
+            return None
+        img_hash = data[self.__getMethodName()]
+        if any(key != img for key, _ in self.findSimilarImages(img_hash, img_sim_min)):
+            if text is None and text_sim_min > 0.0:
+                text = self.__readImageText(image)
+            reposts = self.findReposts(img_hash, text if text is not None else '', img_sim_min, text_sim_min, exclude=img)
+            if reposts:
+                return (False, reposts)
+        if text is None:
+            text = self.__readImageText(image)
+        self.__setImageData(img, *self.__finishImageData((name, digest, data, text, None)))
+        if save:
+            self.saveProcessedDataToCache()
+        return (True, [])
+
+    def addImages(self, imgs: list, workers: int = None, save: bool = True):
+        '''
+        Adds several images in the image directory to the loaded images as per addImage, in the given order.
+        With a SQLite cache, a checkpoint is saved every commit_every images.
+
+        Parameters:
+        - imgs    : a list of filenames of images in the image directory.
+        - workers : if more than 1, images are decoded, hashed and read by that many worker processes (0 uses all cpus), as per processData.
+        - save    : whether to save the changes to the cache if update_cache is set.
+
+        Returns:
+        A list of the filenames which were added, i.e. excluding files which aren't images.
+        '''
+        if workers is not None and (workers == 0 or workers > 1):
+            self.__processFilesParallel(list(imgs), workers if workers else cpu_count())
+        else:
+            read_ahead = self.__getReadAhead()
+            in_flight = deque()
+            for img in imgs:
+                try:
+                    in_flight.append(self.__beginImageData(Image.open(join(self.img_dir, img)), img, join(self.img_dir, img)))
+                except UnidentifiedImageError:
+                    self.vPrint('skipped ' + img + ' (not an image)')
+                self.__finishImagesData(in_flight, read_ahead)
+            self.__finishImagesData(in_flight)
+        if save:
+            self.saveProcessedDataToCache()
+        return [img for img in imgs if img in self.__imageToHash]
+
+    def removeImage(self, img: str, delete_file: bool = False, save: bool = True):
+        '''
+        Removes an image from the loaded images, and from the hash store and image index in place, e.g. for takedowns.
+        Saving only deletes the rows of the image with a SQLite cache, or appends a record of its removal to the journal of a JSON or corpus cache.
+
+        Parameters:
+        - img         : the filename of the image in the image directory.
+        - delete_file : whether to delete the image file too. Otherwise, processData will add the image again.
+        - save        : whether to save the changes to the cache if update_cache is set.
+
+        Returns:
+        True if the image was loaded, otherwise False.
+        '''
+        loaded = img in self.__imageToHash or img in self.__imageToText
+        self.__removeImageData(img)
+        if delete_file and isfile(join(self.img_dir, img)):
+            os.remove(join(self.img_dir, img))
+        if save:
+            self.saveProcessedDataToCache()
+        return loaded
+
+    def __prepareTarget(self,
+                        target_check: str,
+                        recheck_img: bool = True,
+                        generate_repost: bool = False,
+                        save_generated_repost: bool = True):
+        '''
+        Loads (or computes, if necessary or requested) the hash and text of the target image,
+        optionally generating a dummy repost of it, and returns the target hash and text in a tuple.
         '''
-        distances = []
-        name_dist_dict = {}
         d = self.__imageToHash
         t = self.__imageToText
 
-        target_check = img
         target_path = join(self.img_dir, target_check)
         target_img = None
         self.vPrint('we\'ll process post : ' + target_check)
         if generate_repost or recheck_img:
             target_img = Image.open(target_path)
+        target_data = None
         if target_img and (recheck_img or target_check not in d or target_check not in t):
             self.vPrint('computing target metadata')
-            target_hash = Hasher.hashImage(target_img, self.__imagehash_method)
-            target_text = OCR.read2Normalized(target_img)
-            target_texthash = Hasher.hashText(target_text)
-            d[target_check] = target_hash
-            t[target_check] = target_text
-            self.__imageToHash = d
-            self.__imageToText = t
-        else:
-            target_hash = d[target_check]
-            target_text = t[target_check]
-
+            #with an OCR pool, the target is read while the dummy repost is generated and read
+            target_data = self.__beginImageData(target_img, target_check, target_path, recheck=recheck_img)
 
         bad_check = '_REPOST_' + target_check
+        bad_img_data = None
         if generate_repost:
             self.vPrint('generating dummy repost : _REPOST_' + target_check)
             bad_img = generate_bad_repost(target_path)
             bad_img_path = join(self.img_dir, bad_check)
             self.vPrint('computing target metadata')
-            bad_img_hash = Hasher.hashImage(bad_img, self.__imagehash_method)
-            bad_img_text = OCR.read2Normalized(bad_img)
-            bad_img_texthash = Hasher.hashText(bad_img_text)
-            d[bad_check] = bad_img_hash
-            t[bad_check] = bad_img_text
+            bad_img_data = self.__beginImageData(bad_img, bad_check)
             if save_generated_repost:
                 bad_img.save(bad_img_path)
-                self.__imageToHash = d
-                self.__imageToText = t
+
+        if target_data is not None:
+            target_hash, target_text, target_method_hashes = self.__finishImageData(target_data)
+            target_texthash = Hasher.hashText(target_text)
+            self.__setImageData(target_check, target_hash, target_text, target_method_hashes)
+        else:
+            target_hash = d[target_check]
+            target_text = t[target_check]
+
+        if bad_img_data is not None:
+            bad_img_hash, bad_img_text, bad_img_method_hashes = self.__finishImageData(bad_img_data)
+            bad_img_texthash = Hasher.hashText(bad_img_text)
+            self.__setImageData(bad_check, bad_img_hash, bad_img_text, bad_img_method_hashes)
 
         if self.update_cache:
             self.saveProcessedDataToCache()
 
+        return (target_hash, target_text)
+
+    @staticmethod
+    def _sortKey(img_sim_min: float, text_sim_min: float):
+        '''returns the key function used to order detection results for the given thresholds'''
+        def orderOfSort(x):
+            '''dynamic sorting to prioritise text if image and text are both really close'''
+            img_diff = x[1]
+            txt_diff = 1-x[2]
+            if txt_diff <= 1-text_sim_min and img_diff <= 1-img_sim_min:
+                return (txt_diff-1, img_diff-1)
+            return (img_diff, txt_diff)
+        return orderOfSort
+
+    def checkRepostDetection(self,
+                             img: str,
+                             img_sim_min: int = 0.8,
+                             text_sim_min: float = 0.7,
+                             recheck_img: bool = True,
+                             generate_repost: bool = False,
+                             save_generated_repost: bool = True,
+                             text_prefilter: bool = False,
+                             candidates_only: bool = False,
+                             top_k: int = None,
+                             only_positives: bool = False):
+        '''
+        Checks whether reposts can be detected correctly using
+        a naive algorithm considering image hashes and ocr text.
+
+        If text_prefilter is True, text similarities are only computed for images whose texts can reach text_sim_min
+        by cheap length and character histogram bounds, and the other images get a text similarity of 0.0.
+        Whether each image is a repost stays the same, but their order and textSim may differ.
+
+        If candidates_only is True (i.e. for production queries), only images passing the image similarity threshold
+        (found via findSimilarImages, and so the index_method) are compared by text, with the text prefilter,
+        and only they are in the results. Every image left out isn't a repost, so the isRepost decisions stay the same.
+
+        If only_positives is True, only images detected as reposts are in the results.
+        If top_k is given, only the first top_k results are selected (via a heap rather than sorting all of them).
+        Either way, the results are in the same order as they'd be otherwise.
+
+        This assumes the dataset is correctly labelled such that
+        a reposted image is the image name prefixed with _REPOST_.
+
+        If an image is custom crafted and you don't want it to
+        make a deduction of whether it's a true positive or otherwise,
+        simply avoid using the standard format name of:
+            <subreddit>_<postID>.<imgExtension>
+        '''
+        distances = []
+        name_dist_dict = {}
+        t = self.__imageToText
+
+        target_check = img
+        target_hash, target_text = self.__prepareTarget(target_check,
+                                                        recheck_img=recheck_img,
+                                                        generate_repost=generate_repost,
+                                                        save_generated_repost=save_generated_repost)
 
         self.vPrint('\nchecking...')
 
-        for key, value in d.items():
+        if candidates_only:
+            candidates = self.findSimilarImages(target_hash, img_sim_min=img_sim_min)
+            names = [key for key, _ in candidates]
+            img_diffs = [img_diff for _, img_diff in candidates]
+            text_prefilter = True
+        else:
+            names, img_diffs = self.__getHashStore().diff(target_hash)
+            img_diffs = img_diffs.tolist()
+        if text_prefilter and text_sim_min > 0.0:
+            text_sims = repost_batch.findTextSims(target_text, [t[key] for key in names], text_sim_min)
+        else:
+            text_sims = None
+        for i, (key, img_diff) in enumerate(zip(names, img_diffs)):
             if key == target_check:
                 continue
-            img_diff = Hasher.diff(value, target_hash, 'IMAGE')
-            text_sim = 0.0 if text_sim_min <= 0.0 else Levenshtein.ratio(t[key], target_text)
+            if text_sims is not None:
+                text_sim = text_sims[i]
+            else:
+                text_sim = 0.0 if text_sim_min <= 0.0 else Levenshtein.ratio(t[key], target_text)
             distances.append \
                     ( \
                      (key, \
@@ -210,16 +1098,13 @@ class RepostChecker:
                      )
             name_dist_dict[key] = (distances[-1][1], distances[-1][2])
 
-
-        def orderOfSort(x):
-            '''dynamic sorting to prioritise text if image and text are both really close'''
-            img_diff = x[1]
-            txt_diff = 1-x[2]
-            if txt_diff <= 1-text_sim_min and img_diff <= 1-img_sim_min:
-                return (txt_diff-1, img_diff-1)
-            return (img_diff, txt_diff)
-
-        distances.sort(key=orderOfSort)
+        orderOfSort = RepostChecker._sortKey(img_sim_min, text_sim_min)
+        if only_positives:
+            distances = [x for x in distances if x[1] <= 1-img_sim_min and x[2] >= text_sim_min]
+        if top_k is not None:
+            distances = heapq.nsmallest(top_k, distances, key=orderOfSort)
+        else:
+            distances.sort(key=orderOfSort)
         counter = 0
 
         results = {}
@@ -227,11 +1112,15 @@ class RepostChecker:
         FN = 0
 
 
+        #labels are derived from the name table, so names are only ever parsed once
+        rows = self.__nameTable.getRows([a for a, _, _ in distances])
+        target_group = self.__nameTable.getGroups(self.__nameTable.add(target_check))
+        standardFormats = self.__nameTable.isStandard(rows).tolist()
+        knownSames = (self.__nameTable.getGroups(rows) == target_group).tolist()
+
         self.vPrint('--- similar results ---')
         self.vPrint('  SAME?  | IMG_SIM | TEXT_SIM | IMAGE')
-        for a,b,c in distances:
-            standardFormat = len(a.split('.')) == 2 and len(a.split('.')[0].split('_REPOST_')[-1].split('_')) == 2
-            is_known_same = a.split('_REPOST_')[-1] == target_check.split('_REPOST_')[-1]
+        for (a,b,c), row, standardFormat, is_known_same in zip(distances, rows.tolist(), standardFormats, knownSames):
             is_repost = b <= 1-img_sim_min and c >= text_sim_min
             if not standardFormat:
                 validity = '??'
@@ -256,8 +1145,8 @@ class RepostChecker:
                                 (('YES, ' if is_repost else ' NO, ') + validity,1-b,c,a))
 
                     if standardFormat:
-                        subreddit = a.split('_REPOST_')[-1].split('_')[0]
-                        post_id   = a.split('_REPOST_')[-1].split('_')[-1].split('.')[0]
+                        subreddit = self.__nameTable.getSubreddit(row)
+                        post_id   = self.__nameTable.getPostId(row)
                         self.vPrint('reddit.com/r/' + subreddit + '/comments/' + post_id + '/')
                     else:
                         self.vPrint('• this image isn\'t from the standard dataset')
@@ -282,20 +1171,75 @@ class RepostChecker:
 
         return results
 
-    def listRepostsOf(self, img: str):
-        '''lists detected reposts for the given image name in the image directory'''
-        detection = self.checkRepostDetection(img, generate_repost=False)
-        data = []
-        for key, value in detection.items():
-            if value['isRepost'] and key != img:
-                data.append(key)
-        return data
+    def listRepostsOf(self,
+                      img: str,
+                      img_sim_min: float = 0.8,
+                      text_sim_min: float = 0.7,
+                      recheck_img: bool = True,
+                      top_k: int = None):
+        '''
+        lists detected reposts for the given image name in the image directory, or only the first top_k of them if given
+
+        only images found by findSimilarImages are considered, since no other image
+        can pass the image similarity threshold, and their text similarities are computed
+        unless their texts can't reach text_sim_min anyway.
+        the result is ordered the same way as in checkRepostDetection.
+        '''
+        target_hash, target_text = self.__prepareTarget(img, recheck_img=recheck_img)
+        return [key for key, _, _ in self.findReposts(target_hash, target_text, img_sim_min, text_sim_min, top_k=top_k, exclude=img)]
+
+    def findReposts(self,
+                    img_hash: str,
+                    img_text: str,
+                    img_sim_min: float = 0.8,
+                    text_sim_min: float = 0.7,
+                    top_k: int = None,
+                    exclude: str = None,
+                    candidates: list = None):
+        '''
+        Finds the loaded images detected as reposts of an image with the given hash and OCR text, as per listRepostsOf.
+        The image needn't be loaded or in the image directory, e.g. when it's queried over a repost_server.
+
+        Parameters:
+        - img_hash   : the image hash, using the current image hashing method.
+        - img_text   : the normalized OCR text of the image. It's not used if text_sim_min is 0.
+        - top_k      : if given, only the first top_k reposts are returned.
+        - exclude    : an image name to leave out, e.g. the name of the image itself.
+        - candidates : the result of findSimilarImages for img_hash and img_sim_min, if it was already found, so it isn't searched again.
+
+        Returns:
+        A list of (image name, image difference, text similarity) tuples, ordered as in checkRepostDetection.
+        '''
+        t = self.__imageToText
+
+        if candidates is None:
+            candidates = self.findSimilarImages(img_hash, img_sim_min=img_sim_min)
+        candidates = [(key, img_diff) for key, img_diff in candidates if key != exclude]
+        if text_sim_min <= 0.0:
+            text_sims = [0.0]*len(candidates)
+        else:
+            text_sims = repost_batch.findTextSims(img_text, [t[key] for key, _ in candidates], text_sim_min)
+
+        distances = []
+        for (key, img_diff), text_sim in zip(candidates, text_sims):
+            if text_sim >= text_sim_min:
+                distances.append((key, img_diff, text_sim))
+
+        orderOfSort = RepostChecker._sortKey(img_sim_min, text_sim_min)
+        if top_k is not None:
+            distances = heapq.nsmallest(top_k, distances, key=orderOfSort)
+        else:
+            distances.sort(key=orderOfSort)
+        return distances
 
     def generateRepostsForAll(self, count_per_post=1, res=None, rot=None, asp=None, crop=None, uid=None, seed=None):
         '''generates reposts for every single non repost image in the image directory'''
         names = list(filter(lambda x: '_REPOST_' not in x, self.__imageToHash.keys()))
         self.vPrint('generating ' + str(len(names)) + ' reposts')
         interrupted = False
+        #with an OCR pool, reposts are read by its workers while the next ones are generated
+        read_ahead = self.__getReadAhead()
+        in_flight = deque()
         try:
             for i, name in enumerate(sorted(names)):
                 repname = (str(uid) if uid else '') + '_REPOST_' + name
@@ -327,10 +1271,8 @@ class RepostChecker:
                         bad_imgs = [(repname, bad_imgs)]
 
                     for newrepname, bad_img in bad_imgs:
-                        bad_img_hash = Hasher.hashImage(bad_img, self.__imagehash_method)
-                        bad_img_text = OCR.read2Normalized(bad_img)
-                        self.__imageToHash[newrepname] = bad_img_hash
-                        self.__imageToText[newrepname] = bad_img_text
+                        in_flight.append(self.__beginImageData(bad_img, newrepname))
+                        self.__finishImagesData(in_flight, read_ahead)
                 except FileNotFoundError as e:
                     print(e)
                     print("skipped an image that doesn't exist")
@@ -340,10 +1282,12 @@ class RepostChecker:
                     print('skipped an unidentified image')
                     continue
 
+            self.__finishImagesData(in_flight)
             self.vPrint('done!')
         except KeyboardInterrupt:
             self.vPrint('interrupted!')
             interrupted=True
+            self.__readingDigests.clear()
         finally:
             self.saveProcessedDataToCache()
             self.vPrint('saved!')
@@ -426,13 +1370,21 @@ class RepostChecker:
         c = self.update_cache
         self.update_cache = False
 
+        if sample_count:
+            names = names[:sample_count]
+
         try:
-            for i, img in enumerate(names):
-                if sample_count and i >= sample_count:
-                    break
-                res = self.checkRepostDetection(img, img_sim_min=img_sim_min, text_sim_min=text_sim_min, recheck_img=False, generate_repost=False)
-                for _, data in res.items():
-                    vC[data['validity']] += 1
+            store = self.__getHashStore()
+            counts = repost_batch.iterDetectionCounts(store,
+                                                      self.__imageToText,
+                                                      names,
+                                                      img_sim_min=img_sim_min,
+                                                      text_sim_min=text_sim_min,
+                                                      memory_budget=self.memory_budget,
+                                                      labels=self.__nameTable.getLabels(store.getNames()))
+            for i, (img, res) in enumerate(counts):
+                for validity, count in res.items():
+                    vC[validity] += count
                 if v:
                     try:
                         precision = round(vC['TP']/(vC['TP'] + vC['FP'])*100, 1)
@@ -486,39 +1438,55 @@ class RepostChecker:
 
         return vC
 
+    def findDetectionCountsForThresholds(self, imgs_list: list, thresholds: list):
+        '''
+        finds the detection validity counts of the given images against all images,
+        for every (img_sim_min, text_sim_min) pair in thresholds, in a single pass.
+
+        Returns:
+        A dictionary mapping each threshold pair to a dictionary of its TP, FP, TN, FN and ?? counts.
+        '''
+        store = self.__getHashStore()
+        return repost_batch.findDetectionCountsForThresholds(store,
+                                                             self.__imageToText,
+                                                             imgs_list,
+                                                             thresholds,
+                                                             memory_budget=self.memory_budget,
+                                                             labels=self.__nameTable.getLabels(store.getNames()))
+
     def findDetectionRateForThresholdRange(self,
                                            seed:int=69,
                                            sample_count:int=None,
-                                           img_sim_range=(0.7+x*0.3/10 for x in range(0, 10)),
-                                           text_sim_range=(x/10 for x in range(0, 10)),
+                                           img_sim_range=tuple(0.7+x*0.3/10 for x in range(0, 10)),
+                                           text_sim_range=tuple(x/10 for x in range(0, 10)),
                                            save_to_file:str=None):
+        '''
+        finds the repost detection rate for every pair of image and text similarity thresholds in the given ranges.
+
+        all image and text similarities are computed once, and every threshold pair is then evaluated from them,
+        so a large range of thresholds costs roughly the same as a single one.
+        '''
         data = []
 
         self.vPrint('')
         v = self.verbose
-        self.verbose = False
-        c = self.update_cache
-        self.update_cache = False
+        img_sim_range = list(img_sim_range)
+        text_sim_range = list(text_sim_range)
+        thresholds = [(i, t) for i in img_sim_range for t in text_sim_range]
 
-        for i in img_sim_range:
-            for t in text_sim_range:
-                if v:
-                    print('processing img_sim_min %d text_sim_min %.2f' % \
-                          (i, t))
-                res = self.findDetectionRate(sample_count=sample_count,
-                                             seed=seed,
-                                             img_sim_min=i,
-                                             text_sim_min=t)
-
-                d = {'img_sim_min': i, 'text_sim_min': t, 'results': res}
-                if v:
-                    print('completed img_sim_min %d text_sim_min %.2f' % \
-                          (i, t))
-                    print(json.dumps(d, indent=4))
-                data.append(d)
+        if v:
+            print('processing %d threshold pairs' % len(thresholds))
+        names = self.getImagesSample(sample_count=sample_count, seed=seed)
+        counts = self.findDetectionCountsForThresholds(names, thresholds)
 
-        self.verbose = v
-        self.update_cache = c
+        for i, t in thresholds:
+            res = repost_batch.withDetectionMetrics(counts[(i, t)])
+            d = {'img_sim_min': i, 'text_sim_min': t, 'results': res}
+            if v:
+                print('completed img_sim_min %.3f text_sim_min %.2f' % \
+                      (i, t))
+                print(json.dumps(d, indent=4))
+            data.append(d)
 
         output = {'sample_count': sample_count, 'data': data}
 
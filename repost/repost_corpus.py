@@ -0,0 +1,408 @@
+#!/usr/bin/env python3
+
+from collections.abc import ItemsView, MutableMapping, Sequence
+import json
+import mmap
+import os
+import numpy
+from hasher import Hasher, HashStore
+
+#the file starts with this magic, followed by the byte length of a json header and the header itself
+CORPUS_MAGIC = b'RPCORPS1'
+
+_HAS_HASH = 1
+_HAS_TEXT = 2
+
+def writeCorpus(path: str, hashes, texts, method: str, extra: bytes = b'{}'):
+    '''
+    Writes image hashes and OCR texts into a binary corpus file, which can be opened with Corpus.
+
+    Images are stored in the order of hashes, followed by images which only have a text.
+    The file is written to a temporary file first and then moved into place,
+    so processes which have the previous file opened keep reading it unchanged.
+
+    Parameters:
+    - path   : The path of the corpus file.
+    - hashes : A mapping of image names to image hashes.
+    - texts  : A mapping of image names to OCR texts.
+    - method : The image hashing method the hashes were computed with.
+    - extra  : Utf-8 encoded json of any other data to store, which is only parsed when read.
+    '''
+    names = list(hashes.keys())
+    names += [name for name in texts.keys() if name not in hashes]
+
+    hex_len = None
+    for name in names:
+        if name in hashes:
+            hex_len = len(hashes[name])
+            break
+    hash_bytes = len(Hasher.hashToBytes('0'*hex_len)) if hex_len else 0
+
+    flags = numpy.zeros(len(names), dtype=numpy.uint8)
+    matrix = numpy.zeros((len(names), hash_bytes), dtype=numpy.uint8)
+    mismatched = {}
+    for row, name in enumerate(names):
+        if name in hashes:
+            flags[row] |= _HAS_HASH
+            value = hashes[name]
+            if len(value) == hex_len:
+                matrix[row] = numpy.frombuffer(Hasher.hashToBytes(value), dtype=numpy.uint8)
+            else:
+                mismatched[str(row)] = value
+        if name in texts:
+            flags[row] |= _HAS_TEXT
+
+    name_offsets, name_blob = _pack(names)
+    text_offsets, text_blob = _pack([texts.get(name, '') for name in names])
+    sorted_rows = numpy.array(sorted(range(len(names)), key=names.__getitem__), dtype=numpy.int64)
+
+    sections = [('hashes', matrix.tobytes()), ('flags', flags.tobytes()),
+                ('name_offsets', name_offsets), ('text_offsets', text_offsets), ('sorted_rows', sorted_rows.tobytes()),
+                ('name_blob', name_blob), ('text_blob', text_blob), ('extra', extra)]
+    header = {'count': len(names), 'hex_len': hex_len, 'hash_bytes': hash_bytes,
+              'method': method, 'mismatched': mismatched, 'sections': {}}
+    offset = 0
+    for key, data in sections:
+        header['sections'][key] = [offset, len(data)]
+        #sections are 8 byte aligned so the numeric columns can be viewed in place
+        offset += (len(data) + 7) // 8 * 8
+
+    header_bytes = json.dumps(header).encode('utf-8')
+    base = len(CORPUS_MAGIC) + 8 + len(header_bytes)
+    base = (base + 7) // 8 * 8
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(CORPUS_MAGIC)
+        f.write(len(header_bytes).to_bytes(8, 'little'))
+        f.write(header_bytes)
+        for key, data in sections:
+            f.seek(base + header['sections'][key][0])
+            f.write(data)
+        f.truncate(base + offset)
+    os.replace(tmp_path, path)
+
+def _pack(strings: list):
+    '''returns the bytes of the int64 offsets of the utf-8 encoded strings into their blob, and the blob'''
+    encoded = [s.encode('utf-8') for s in strings]
+    offsets = numpy.zeros(len(encoded)+1, dtype=numpy.int64)
+    offsets[1:] = numpy.cumsum([len(e) for e in encoded], dtype=numpy.int64)
+    return (offsets.tobytes(), b''.join(encoded))
+
+class Corpus:
+    '''
+    Read-only binary corpus of image hashes and OCR texts, opened with mmap so it isn't parsed on load.
+
+    The file holds a fixed width hash column (a uint64 per image for 64 bit hashes), offsets into a blob of names
+    and a blob of texts, and the rows sorted by name so that an image can be found by binary search.
+    Processes opening the same file share its pages in the page cache.
+    '''
+
+    def __init__(self, path: str):
+        '''
+        Opens the corpus at the given path.
+
+        Parameters:
+        - path : The path of the corpus file, as written by writeCorpus.
+        '''
+        self.path = path
+        with open(path, 'rb') as f:
+            self.__mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.__mm[:len(CORPUS_MAGIC)] != CORPUS_MAGIC:
+            raise ValueError(path + ' is not a repost checker corpus')
+        header_len = int.from_bytes(self.__mm[len(CORPUS_MAGIC):len(CORPUS_MAGIC)+8], 'little')
+        start = len(CORPUS_MAGIC) + 8
+        self.__header = json.loads(self.__mm[start:start+header_len].decode('utf-8'))
+        self.__base = (start + header_len + 7) // 8 * 8
+
+        n = self.__header['count']
+        self.__hashes = self.__view('hashes', numpy.uint8).reshape((n, self.__header['hash_bytes']))
+        self.__flags = self.__view('flags', numpy.uint8)
+        self.__nameOffsets = self.__view('name_offsets', numpy.int64)
+        self.__textOffsets = self.__view('text_offsets', numpy.int64)
+        self.__sortedRows = self.__view('sorted_rows', numpy.int64)
+        self.__mismatched = {int(row): value for row, value in self.__header['mismatched'].items()}
+        self.__extra = None
+
+    def __getstate__(self):
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'])
+
+    def __view(self, key, dtype):
+        offset, length = self.__header['sections'][key]
+        return numpy.frombuffer(self.__mm, dtype=dtype, count=length // numpy.dtype(dtype).itemsize, offset=self.__base + offset)
+
+    def __blob(self, key, offsets, row):
+        start = self.__base + self.__header['sections'][key][0]
+        return self.__mm[start+int(offsets[row]):start+int(offsets[row+1])].decode('utf-8')
+
+    def __len__(self):
+        return self.__header['count']
+
+    def getMethod(self) -> str:
+        '''Returns the image hashing method the hashes were computed with.'''
+        return self.__header['method']
+
+    def getName(self, row: int) -> str:
+        return self.__blob('name_blob', self.__nameOffsets, row)
+
+    def getNames(self, rows) -> list:
+        '''Returns the names of the given numpy array of rows, decoded in a single pass over the name blob.'''
+        return self.__blobs('name_blob', self.__nameOffsets, rows)
+
+    def getTexts(self, rows) -> list:
+        '''Returns the texts of the given numpy array of rows, decoded in a single pass over the text blob.'''
+        return self.__blobs('text_blob', self.__textOffsets, rows)
+
+    def getHashes(self, rows) -> list:
+        '''Returns the hashes of the given numpy array of rows, formatted in a single pass over the hash matrix.'''
+        hex_len = self.__header['hex_len']
+        if not len(rows) or not hex_len:
+            return [self.getHash(row) for row in rows.tolist()]
+        width = self.__header['hash_bytes']*2
+        packed = self.__hashes[rows].tobytes().hex()
+        hashes = [packed[i+width-hex_len:i+width] for i in range(0, len(packed), width)]
+        for i, row in enumerate(rows.tolist()):
+            if row in self.__mismatched:
+                hashes[i] = self.__mismatched[row]
+        return hashes
+
+    def __blobs(self, key, offsets, rows):
+        start = self.__base + self.__header['sections'][key][0]
+        blob = self.__mm[start+int(offsets[0]):start+int(offsets[-1])]
+        starts = offsets[rows].tolist()
+        ends = offsets[rows+1].tolist()
+        return [blob[a:b].decode('utf-8') for a, b in zip(starts, ends)]
+
+    def findRow(self, name: str) -> int:
+        '''Returns the row of the given image name by binary search over the sorted rows, or None if it isn't in the corpus.'''
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.getName(int(self.__sortedRows[mid])) < name:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self) and self.getName(int(self.__sortedRows[lo])) == name:
+            return int(self.__sortedRows[lo])
+        return None
+
+    def hasHash(self, row: int) -> bool:
+        return bool(self.__flags[row] & _HAS_HASH)
+
+    def hasText(self, row: int) -> bool:
+        return bool(self.__flags[row] & _HAS_TEXT)
+
+    def getHash(self, row: int) -> str:
+        if row in self.__mismatched:
+            return self.__mismatched[row]
+        return self.__hashes[row].tobytes().hex()[-self.__header['hex_len']:]
+
+    def getText(self, row: int) -> str:
+        return self.__blob('text_blob', self.__textOffsets, row)
+
+    def getHashRows(self):
+        '''Returns a numpy array of the rows which have a hash, in order.'''
+        return numpy.flatnonzero(self.__flags & _HAS_HASH)
+
+    def getTextRows(self):
+        '''Returns a numpy array of the rows which have a text, in order.'''
+        return numpy.flatnonzero(self.__flags & _HAS_TEXT)
+
+    def getMatrix(self):
+        '''Returns the packed hash matrix (one row per image, zeros for images without a hash or with a hash of another length).'''
+        return self.__hashes
+
+    def getMismatched(self) -> dict:
+        '''Returns a dictionary mapping rows to hashes which don't fit into the hash matrix.'''
+        return dict(self.__mismatched)
+
+    def getHexLength(self) -> int:
+        return self.__header['hex_len']
+
+    def getExtraBytes(self) -> bytes:
+        '''Returns the utf-8 encoded json of the extra data, without parsing it.'''
+        offset, length = self.__header['sections']['extra']
+        return self.__mm[self.__base+offset:self.__base+offset+length]
+
+    def getExtra(self) -> dict:
+        '''Returns the parsed extra data. It's parsed on first use only.'''
+        if self.__extra is None:
+            self.__extra = json.loads(self.getExtraBytes().decode('utf-8'))
+        return self.__extra
+
+    def getExtraItem(self, key: str) -> dict:
+        '''Returns the dictionary stored under the key in the extra data, or an empty one.'''
+        return self.getExtra().get(key, {})
+
+class CorpusColumn(MutableMapping):
+    '''
+    Mapping of image names to either the hashes or the texts of a Corpus, which behaves like a dictionary.
+
+    Values are read from the corpus on access. Changes are kept in memory on top of the corpus,
+    with changed images keeping their position and new images being appended, as in a dictionary.
+    '''
+
+    def __init__(self, corpus: Corpus, column: str):
+        '''
+        Parameters:
+        - corpus : The corpus to read from.
+        - column : Either 'hash' or 'text'.
+        '''
+        if column not in ('hash', 'text'):
+            raise ValueError('An unexpected corpus column ' + str(column) + ' was given')
+        self.__corpus = corpus
+        self.__column = column
+        self.__baseRows = corpus.getHashRows() if column == 'hash' else corpus.getTextRows()
+        self.__changed = {}
+        self.__added = {}
+        self.__removed = set()
+
+    def __baseRow(self, name):
+        '''returns the row of the name in the corpus if it has a value in this column, or None otherwise'''
+        row = self.__corpus.findRow(name)
+        if row is None:
+            return None
+        if not (self.__corpus.hasHash(row) if self.__column == 'hash' else self.__corpus.hasText(row)):
+            return None
+        return row
+
+    def __getitem__(self, name):
+        if name in self.__changed:
+            return self.__changed[name]
+        if name in self.__added:
+            return self.__added[name]
+        row = None if name in self.__removed else self.__baseRow(name)
+        if row is None:
+            raise KeyError(name)
+        return self.__corpus.getHash(row) if self.__column == 'hash' else self.__corpus.getText(row)
+
+    def __contains__(self, name):
+        if name in self.__changed or name in self.__added:
+            return True
+        return name not in self.__removed and self.__baseRow(name) is not None
+
+    def __setitem__(self, name, value):
+        if name in self.__added or name in self.__changed:
+            (self.__added if name in self.__added else self.__changed)[name] = value
+        elif name not in self.__removed and self.__baseRow(name) is not None:
+            self.__changed[name] = value
+        else:
+            #removed images which are set again are appended, as in a dictionary
+            self.__added[name] = value
+
+    def __delitem__(self, name):
+        if name in self.__added:
+            del self.__added[name]
+        elif name in self:
+            self.__changed.pop(name, None)
+            self.__removed.add(name)
+        else:
+            raise KeyError(name)
+
+    def __iter__(self):
+        for name in self.__corpus.getNames(self.__baseRows):
+            if name not in self.__removed:
+                yield name
+        yield from list(self.__added)
+
+    def __len__(self):
+        return len(self.__baseRows) - len(self.__removed) + len(self.__added)
+
+    def items(self):
+        '''Returns the (name, value) pairs in order, reading the corpus row by row rather than looking up every name.'''
+        return CorpusItemsView(self)
+
+    def toHashStore(self) -> HashStore:
+        '''
+        Returns a HashStore of the hashes, using the corpus' memory mapped hash matrix in place.
+
+        Images with hashes are written first, so their rows are a view of the matrix and stay shared in the page cache
+        until the store is changed. Names are only decoded for the rows a query returns.
+        '''
+        if self.__column != 'hash':
+            raise ValueError('Only the hash column of a corpus can be converted into a HashStore')
+        rows = self.__baseRows
+        count = len(rows)
+        if count and rows[-1] == count - 1:
+            matrix = self.__corpus.getMatrix()[:count]
+            mismatched = {row: value for row, value in self.__corpus.getMismatched().items() if row < count}
+        else:
+            new_rows = {row: i for i, row in enumerate(rows.tolist())}
+            matrix = self.__corpus.getMatrix()[rows]
+            mismatched = {new_rows[row]: value for row, value in self.__corpus.getMismatched().items() if row in new_rows}
+        store = HashStore.fromMatrix(CorpusNames(self.__corpus, rows), matrix, self.__corpus.getHexLength(), mismatched)
+        for name in self.__removed:
+            store.remove(name)
+        for name, value in self.__changed.items():
+            store.add(name, value)
+        for name, value in self.__added.items():
+            store.add(name, value)
+        return store
+
+    def _iterItems(self):
+        rows = self.__baseRows
+        names = self.__corpus.getNames(rows)
+        values = self.__corpus.getHashes(rows) if self.__column == 'hash' else self.__corpus.getTexts(rows)
+        for name, value in zip(names, values):
+            if name in self.__removed:
+                continue
+            yield (name, self.__changed.get(name, value))
+        yield from list(self.__added.items())
+
+class CorpusItemsView(ItemsView):
+    '''Items of a CorpusColumn, iterated row by row.'''
+
+    def __iter__(self):
+        return self._mapping._iterItems()
+
+class CorpusNames(Sequence):
+    '''Sequence of the names of the given rows of a Corpus, which are decoded when accessed.'''
+
+    def __init__(self, corpus: Corpus, rows):
+        self.__corpus = corpus
+        self.__rows = rows
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        return self.__corpus.getName(int(self.__rows[i]))
+
+    def __len__(self):
+        return len(self.__rows)
+
+    def __iter__(self):
+        for row in self.__rows.tolist():
+            yield self.__corpus.getName(row)
+
+class LazyDict(MutableMapping):
+    '''Dictionary which is only loaded, via the given function, when it's first used.'''
+
+    def __init__(self, loader):
+        self.__loader = loader
+        self.__data = None
+
+    def isLoaded(self) -> bool:
+        return self.__data is not None
+
+    def __getData(self):
+        if self.__data is None:
+            self.__data = self.__loader()
+        return self.__data
+
+    def __getitem__(self, key):
+        return self.__getData()[key]
+
+    def __setitem__(self, key, value):
+        self.__getData()[key] = value
+
+    def __delitem__(self, key):
+        del self.__getData()[key]
+
+    def __iter__(self):
+        return iter(self.__getData())
+
+    def __len__(self):
+        return len(self.__getData())
@@ -2,8 +2,12 @@
 
 try:
     from repost_checker import RepostChecker
+    from repost_shared import SharedCorpus
+    import repost_batch
 except ImportError:
     from .repost_checker import RepostChecker
+    from .repost_shared import SharedCorpus
+    from . import repost_batch
 from multiprocessing import Pool, cpu_count
 import json
 import time
@@ -22,34 +26,47 @@ def configurePoolRepostChecker(img_dir: str, json_filename='__repost_check_data_
     _poolRepostChecker.readProcessedDataFromCache()
     #return _poolRepostChecker
 
+def _initSharedCorpusWorker(descriptor: dict, memory_budget: int):
+    '''attaches this worker process to the shared corpus once, so tasks only need to send image names and thresholds'''
+    global _workerCorpus, _workerTexts, _workerLabels, _workerMemoryBudget
+    _workerCorpus = SharedCorpus.attach(descriptor)
+    _workerTexts = _workerCorpus.getTexts()
+    _workerLabels = repost_batch.getNameLabels(_workerCorpus.getNames())
+    _workerMemoryBudget = memory_budget
+
 def _helperFindDetectionRateFromImage(args):
-    i = args[1]
-    img = args[2]
-    idm = args[3]
-    tsm = args[4]
-    _VERBOSE = args[5]
+    i = args[0]
+    img = args[1]
+    idm = args[2]
+    tsm = args[3]
+    _VERBOSE = args[4]
     if _VERBOSE:
         print('process : item %-5d i.e. %s' % (i, img))
-    res = args[0].findDetectionRate(imgs_list=[img],
-                                               img_sim_min=idm,
-                                               text_sim_min=tsm)
+    counts = repost_batch.iterDetectionCounts(_workerCorpus, _workerTexts, [img],
+                                              img_sim_min=idm,
+                                              text_sim_min=tsm,
+                                              memory_budget=_workerMemoryBudget,
+                                              labels=_workerLabels)
+    res = {'TP':0,'FP':0,'TN':0,'FN':0,'??':0}
+    for _, vC in counts:
+        repost_batch.addDetectionCounts(res, vC)
     if _VERBOSE:
         print('finished: item %-5d i.e. %s' % (i, img))
     return res
 
-def _helperFindDetectionRateFromThresholds(args):
-    i = args[1]
-    imgl = args[2]
-    idm = args[3]
-    tsm = args[4]
-    _VERBOSE = args[5]
+def _helperFindDetectionCountsForThresholds(args):
+    i = args[0]
+    imgl = args[1]
+    thresholds = args[2]
+    _VERBOSE = args[3]
     if _VERBOSE:
-        print('process : pair %-4d i.e. ism %4.3f tsm %4.3f' % (i, idm, tsm))
-    res = args[0].findDetectionRate(imgs_list=imgl, img_sim_min=idm, text_sim_min=tsm)
-    d = {'img_sim_min': idm, 'text_sim_min': tsm, 'results': res}
+        print('process : part %-4d i.e. %d items' % (i, len(imgl)))
+    res = repost_batch.findDetectionCountsForThresholds(_workerCorpus, _workerTexts, imgl, thresholds,
+                                                        memory_budget=_workerMemoryBudget,
+                                                        labels=_workerLabels)
     if _VERBOSE:
-        print('finished: pair %-4d i.e. ism %4.3f tsm %4.3f -> %s' % (i, idm, tsm, res))
-    return d
+        print('finished: part %-4d i.e. %d items' % (i, len(imgl)))
+    return res
 
 def findDetectionRate(imgs_list: list = None,
                       seed: int = 69,
@@ -84,17 +101,19 @@ def findDetectionRate(imgs_list: list = None,
     print('note: this should utilise at most %d%% of cpu power.' % int(cpu_threshold*100))
     print('elements to process: %d' % len(names))
 
-    args_list = list(map(lambda x: [_poolRepostChecker, 0, x, img_sim_min, text_sim_min, verbose], names))
-    for i, _ in enumerate(args_list):
-        args_list[i][1] = i + 1
+    args_list = [(i, x, img_sim_min, text_sim_min, verbose) for i, x in enumerate(names, 1)]
 
-    pool = Pool(max(int(cpu_count()*cpu_threshold), 1))
+    #the corpus is placed in shared memory once, rather than being pickled with every task
     results = []
-    for i, x in enumerate(pool.imap_unordered(_helperFindDetectionRateFromImage, args_list), 1):
-        print("[%6.2f%% complete]" % (i/len(args_list)*100))
-        results.append(x)
-    pool.close()
-    pool.join()
+    with _poolRepostChecker.createSharedCorpus() as corpus:
+        pool = Pool(max(int(cpu_count()*cpu_threshold), 1),
+                    initializer=_initSharedCorpusWorker,
+                    initargs=(corpus.getDescriptor(), _poolRepostChecker.memory_budget))
+        for i, x in enumerate(pool.imap_unordered(_helperFindDetectionRateFromImage, args_list), 1):
+            print("[%6.2f%% complete]" % (i/len(args_list)*100))
+            results.append(x)
+        pool.close()
+        pool.join()
 
     print('tallying up results')
 
@@ -198,6 +217,7 @@ def findDetectionRateForThresholdRange(seed:int=69,
     print('img_diffs: ' + str(img_sim_range))
     print('text_sims: ' + str(text_sim_range))
     print()
+    thresholds = []
     for i in list(img_sim_range):
         for t in list(text_sim_range):
             if results:
@@ -205,15 +225,14 @@ def findDetectionRateForThresholdRange(seed:int=69,
                 if pair in pairs_alr_in_results:
                     excluded_count += 1
                     continue
-            counter += 1
-            args_list.append((_poolRepostChecker, counter, names, i, t, verbose))
+            thresholds.append((i,t))
 
-    if len(args_list) == 0:
+    if len(thresholds) == 0:
         print("nothing to do!")
         return {'sample_count': sample_count, 'data': results}
 
     print('elements to process per threshold: %d' % len(names))
-    print('threshold pairs to process       : %d' % len(args_list), end='')
+    print('threshold pairs to process       : %d' % len(thresholds), end='')
     if excluded_count > 0:
         print(' (excludes %d already processed pairs)' % excluded_count)
     else:
@@ -221,15 +240,29 @@ def findDetectionRateForThresholdRange(seed:int=69,
 
     print()
 
-    pool = Pool(max(int(cpu_count()*cpu_threshold), 1))
-    for i, e in enumerate(pool.imap_unordered(_helperFindDetectionRateFromThresholds, args_list), 1):
-        print("[%6.2f%% complete]" % (i/len(args_list)*100))
-        results.append(e)
-    pool.close()
-    pool.join()
+    #all threshold pairs are evaluated in a single pass, so the work is split by images instead
+    processes = max(int(cpu_count()*cpu_threshold), 1)
+    parts = max(1, min(len(names), processes*4))
+    for i in range(parts):
+        counter += 1
+        args_list.append((counter, names[i::parts], thresholds, verbose))
+
+    counts = {pair: {'TP':0,'FP':0,'TN':0,'FN':0,'??':0} for pair in thresholds}
+    with _poolRepostChecker.createSharedCorpus() as corpus:
+        pool = Pool(processes,
+                    initializer=_initSharedCorpusWorker,
+                    initargs=(corpus.getDescriptor(), _poolRepostChecker.memory_budget))
+        for i, e in enumerate(pool.imap_unordered(_helperFindDetectionCountsForThresholds, args_list), 1):
+            print("[%6.2f%% complete]" % (i/len(args_list)*100))
+            for pair, vC in e.items():
+                repost_batch.addDetectionCounts(counts[pair], vC)
+        pool.close()
+        pool.join()
 
     print()
     print('tallying up and sorting results')
+    for (i,t), vC in counts.items():
+        results.append({'img_sim_min': i, 'text_sim_min': t, 'results': repost_batch.withDetectionMetrics(vC)})
     results.sort(key=lambda x: (x['img_sim_min'], x['text_sim_min']))
 
     output = {'sample_count': sample_count, 'data': results}
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+import numpy
+
+class NameTable:
+    '''
+    Compact table of the metadata encoded in image names, parsed once per name.
+
+    Image names in the standard dataset format are <subreddit>_<postID>.<imgExtension>, and generated reposts of them
+    are prefixed with an optional variant uid and _REPOST_. Each name gets a row with integer ids of its subreddit,
+    post id and the image it's a repost of (itself if it isn't a repost), so that labels can be derived
+    by integer comparisons rather than by parsing names again.
+    '''
+
+    def __init__(self):
+        self.__rows = {}
+        self.__ids = {'subreddit': {}, 'post': {}, 'group': {}}
+        self.__values = {key: [] for key in self.__ids}
+        self.__size = 0
+        self.__standard = numpy.zeros(16, dtype=bool)
+        self.__columns = {key: numpy.zeros(16, dtype=numpy.int64) for key in self.__ids}
+
+    def __len__(self):
+        return self.__size
+
+    def __contains__(self, name):
+        return name in self.__rows
+
+    def __intern(self, key, value):
+        ids = self.__ids[key]
+        if value not in ids:
+            ids[value] = len(ids)
+            self.__values[key].append(value)
+        return ids[value]
+
+    def add(self, name: str) -> int:
+        '''Parses the name into a new row if it isn't in the table yet, and returns its row.'''
+        row = self.__rows.get(name)
+        if row is not None:
+            return row
+
+        if self.__size == len(self.__standard):
+            capacity = self.__size*2
+            self.__standard = numpy.resize(self.__standard, capacity)
+            for key in self.__columns:
+                self.__columns[key] = numpy.resize(self.__columns[key], capacity)
+
+        original = name.split('_REPOST_')[-1]
+        row = self.__size
+        self.__standard[row] = len(name.split('.')) == 2 and len(name.split('.')[0].split('_REPOST_')[-1].split('_')) == 2
+        self.__columns['subreddit'][row] = self.__intern('subreddit', original.split('_')[0])
+        self.__columns['post'][row] = self.__intern('post', original.split('_')[-1].split('.')[0])
+        self.__columns['group'][row] = self.__intern('group', original)
+
+        self.__rows[name] = row
+        self.__size += 1
+        return row
+
+    def getRows(self, names: list):
+        '''Returns a numpy array of the rows of the names, adding any which aren't in the table yet.'''
+        return numpy.array([self.add(name) for name in names], dtype=numpy.int64)
+
+    def getLabels(self, names: list):
+        '''
+        Returns the labels used for deducing detection validity, without parsing names already in the table.
+
+        Returns:
+        A tuple of a numpy bool array indicating whether each name is in the standard dataset format, and
+        a numpy int array of group ids, such that names of known same images share the same group id.
+        '''
+        rows = self.getRows(names)
+        return (self.__standard[rows], self.__columns['group'][rows])
+
+    def isStandard(self, rows):
+        '''Returns whether the names of the rows are in the standard dataset format.'''
+        return self.__standard[:self.__size][rows]
+
+    def getGroups(self, rows):
+        '''Returns the ids of the images the names of the rows are reposts of, such that names of known same images share the same id.'''
+        return self.__columns['group'][:self.__size][rows]
+
+    def getSubreddit(self, row: int) -> str:
+        return self.__values['subreddit'][self.__columns['subreddit'][row]]
+
+    def getPostId(self, row: int) -> str:
+        return self.__values['post'][self.__columns['post'][row]]
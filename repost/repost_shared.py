@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+
+from collections.abc import Mapping
+from multiprocessing import shared_memory
+import numpy
+
+class SharedTexts(Mapping):
+    '''
+    Read-only mapping of image names to OCR texts of a SharedCorpus.
+    Texts are decoded from the shared blob on access, so attaching to a corpus doesn't copy them.
+    '''
+
+    def __init__(self, corpus):
+        self.__corpus = corpus
+
+    def __getitem__(self, name):
+        return self.__corpus.getText(name)
+
+    def __iter__(self):
+        return iter(self.__corpus.getNames())
+
+    def __len__(self):
+        return len(self.__corpus)
+
+class SharedCorpus:
+    '''
+    Image hashes and OCR texts of a corpus placed once in a multiprocessing.shared_memory segment,
+    so worker processes can attach to it rather than being sent the corpus with every task.
+
+    The segment holds the packed hash matrix (as in HashStore.getMatrix) followed by
+    offsets and utf-8 blobs of the image names and texts.
+    A corpus provides the parts of the HashStore interface used by repost_batch, and its texts via getTexts.
+
+    The process which creates the corpus owns the segment and frees it on close.
+    Other processes attach to it via SharedCorpus.attach(corpus.getDescriptor()).
+    '''
+
+    def __init__(self, shm, descriptor: dict, owner: bool):
+        self.__shm = shm
+        self.__descriptor = descriptor
+        self.__owner = owner
+
+        n = descriptor['size']
+        width = descriptor['width']
+        buf = shm.buf
+        self.__matrix = numpy.ndarray((n, width), dtype=numpy.uint8, buffer=buf, offset=descriptor['matrix'])
+        self.__nameOffsets = numpy.ndarray(n+1, dtype=numpy.int64, buffer=buf, offset=descriptor['name_offsets'])
+        self.__textOffsets = numpy.ndarray(n+1, dtype=numpy.int64, buffer=buf, offset=descriptor['text_offsets'])
+        self.__names = [bytes(buf[descriptor['name_blob']+a:descriptor['name_blob']+b]).decode('utf-8') \
+                        for a, b in zip(self.__nameOffsets[:-1].tolist(), self.__nameOffsets[1:].tolist())]
+        self.__rows = {name: i for i, name in enumerate(self.__names)}
+
+    @staticmethod
+    def create(store, texts: dict):
+        '''
+        Creates a shared corpus from a HashStore and a dictionary mapping its image names to OCR texts.
+        Images without a text are given an empty text.
+        '''
+        names = store.getNames()
+        matrix = store.getMatrix()
+        name_blob, name_offsets = SharedCorpus.__pack(names)
+        text_blob, text_offsets = SharedCorpus.__pack([texts.get(name, '') for name in names])
+
+        descriptor = {'size': len(names),
+                      'width': matrix.shape[1] if matrix.ndim == 2 else 0,
+                      'bits': store.getBits(),
+                      'mismatched': store.getMismatched()}
+        layout = [('name_offsets', name_offsets), ('text_offsets', text_offsets),
+                  ('matrix', numpy.ascontiguousarray(matrix, dtype=numpy.uint8).tobytes()),
+                  ('name_blob', name_blob), ('text_blob', text_blob)]
+        offset = 0
+        for key, data in layout:
+            descriptor[key] = offset
+            #sections are 8 byte aligned so the offset arrays can be viewed in place
+            offset += (len(data) + 7) // 8 * 8
+
+        shm = shared_memory.SharedMemory(create=True, size=max(1, offset))
+        for key, data in layout:
+            shm.buf[descriptor[key]:descriptor[key]+len(data)] = data
+        descriptor['name'] = shm.name
+        return SharedCorpus(shm, descriptor, owner=True)
+
+    @staticmethod
+    def attach(descriptor: dict):
+        '''Attaches to a shared corpus created in another process, given its descriptor.'''
+        return SharedCorpus(shared_memory.SharedMemory(name=descriptor['name']), descriptor, owner=False)
+
+    @staticmethod
+    def __pack(strings: list):
+        '''returns a utf-8 blob of the strings and the bytes of their int64 offsets into it'''
+        encoded = [s.encode('utf-8') for s in strings]
+        offsets = numpy.zeros(len(encoded)+1, dtype=numpy.int64)
+        offsets[1:] = numpy.cumsum([len(e) for e in encoded], dtype=numpy.int64)
+        return (b''.join(encoded), offsets.tobytes())
+
+    def getDescriptor(self) -> dict:
+        '''Returns the small picklable description of this corpus which other processes attach with.'''
+        return self.__descriptor
+
+    def __len__(self):
+        return len(self.__names)
+
+    def __contains__(self, name):
+        return name in self.__rows
+
+    def __getitem__(self, name):
+        row = self.__rows[name]
+        if row in self.__descriptor['mismatched']:
+            return self.__descriptor['mismatched'][row]
+        return self.__matrix[row].tobytes().hex()[-self.__descriptor['bits']//4:]
+
+    def getNames(self) -> list:
+        return list(self.__names)
+
+    def getRow(self, name: str) -> int:
+        return self.__rows[name]
+
+    def getName(self, row: int) -> str:
+        return self.__names[row]
+
+    def getMatrix(self):
+        return self.__matrix
+
+    def getMismatched(self) -> dict:
+        return dict(self.__descriptor['mismatched'])
+
+    def getBits(self) -> int:
+        return self.__descriptor['bits']
+
+    def getText(self, name: str) -> str:
+        row = self.__rows[name]
+        start = self.__descriptor['text_blob']
+        return bytes(self.__shm.buf[start+int(self.__textOffsets[row]):start+int(self.__textOffsets[row+1])]).decode('utf-8')
+
+    def getTexts(self) -> SharedTexts:
+        '''Returns a read-only mapping of image names to texts, as used by repost_batch.'''
+        return SharedTexts(self)
+
+    def close(self):
+        '''Detaches from the segment, and frees it if this process created it.'''
+        self.__matrix = None
+        self.__nameOffsets = None
+        self.__textOffsets = None
+        self.__shm.close()
+        if self.__owner:
+            self.__shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
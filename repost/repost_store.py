@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+
+import sqlite3
+
+class RepostStore:
+    '''
+    SQLite backed store of processed image data, i.e. image hashes (one per hashing method),
+    OCR texts and digest cache entries.
+
+    The database is opened in WAL mode, all writes are upserts by key so that saving only costs
+    as much as the data changed since the last commit, and an interrupted write never corrupts
+    previously committed data.
+
+    Every write transaction increments a generation counter, and rows are stamped with the generation they were
+    last written in, so readers can load only the rows changed since a generation they have already loaded.
+    Removals increment a separate counter, as they can't be loaded incrementally.
+
+    A store may be used from another thread than the one which opened it, but not by several threads at once.
+    '''
+
+    def __init__(self, path: str):
+        '''
+        Opens (or creates) the store at the given path.
+
+        Parameters:
+        - path : The path of the SQLite database file.
+        '''
+        self.path = path
+        self.__conn = sqlite3.connect(path, check_same_thread=False)
+        self.__conn.execute('PRAGMA journal_mode=WAL')
+        self.__conn.execute('PRAGMA synchronous=NORMAL')
+        self.__conn.executescript('''
+            CREATE TABLE IF NOT EXISTS image_hash (
+                name   TEXT NOT NULL,
+                method TEXT NOT NULL,
+                hash   TEXT NOT NULL,
+                PRIMARY KEY (name, method)
+            );
+            CREATE TABLE IF NOT EXISTS image_text (
+                name TEXT PRIMARY KEY,
+                text TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS digest_data (
+                digest TEXT NOT NULL,
+                key    TEXT NOT NULL,
+                value  TEXT NOT NULL,
+                PRIMARY KEY (digest, key)
+            );
+            CREATE TABLE IF NOT EXISTS meta (
+                key   TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS image_hash_method ON image_hash (method);
+            INSERT OR IGNORE INTO meta (key, value) VALUES ('seq', 0), ('removed', 0);
+        ''')
+        for table in ('image_hash', 'image_text', 'digest_data'):
+            #stores created before generations were tracked are migrated, with all existing rows in generation 0
+            columns = [row[1] for row in self.__conn.execute('PRAGMA table_info(%s)' % table)]
+            if 'seq' not in columns:
+                self.__conn.execute('ALTER TABLE %s ADD COLUMN seq INTEGER NOT NULL DEFAULT 0' % table)
+        self.__conn.commit()
+        self.__seq = None
+
+    def __getWriteSeq(self):
+        '''returns the generation of the current write transaction, starting a new one if necessary'''
+        if self.__seq is None or not self.__conn.in_transaction:
+            self.__conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'seq'")
+            self.__seq = self.__conn.execute("SELECT value FROM meta WHERE key = 'seq'").fetchone()[0]
+        return self.__seq
+
+    def getGeneration(self) -> tuple:
+        '''Returns a tuple of the latest committed generation and the number of removals, for loading changes incrementally.'''
+        rows = dict(self.__conn.execute("SELECT key, value FROM meta WHERE key IN ('seq', 'removed')"))
+        return (rows['seq'], rows['removed'])
+
+    def isEmpty(self) -> bool:
+        '''Returns whether the store has no images at all.'''
+        return self.__conn.execute('SELECT 1 FROM image_text LIMIT 1').fetchone() is None and \
+               self.__conn.execute('SELECT 1 FROM image_hash LIMIT 1').fetchone() is None
+
+    def setImageHash(self, name: str, method: str, img_hash: str):
+        '''Inserts or updates the hash of an image for a hashing method. Updated images keep their position.'''
+        self.__conn.execute('INSERT INTO image_hash (name, method, hash, seq) VALUES (?, ?, ?, ?) '
+                            'ON CONFLICT (name, method) DO UPDATE SET hash = excluded.hash, seq = excluded.seq',
+                            (name, method, img_hash, self.__getWriteSeq()))
+
+    def setImageText(self, name: str, text: str):
+        '''Inserts or updates the OCR text of an image.'''
+        self.__conn.execute('INSERT INTO image_text (name, text, seq) VALUES (?, ?, ?) '
+                            'ON CONFLICT (name) DO UPDATE SET text = excluded.text, seq = excluded.seq',
+                            (name, text, self.__getWriteSeq()))
+
+    def setDigestData(self, digest: str, key: str, value: str):
+        '''Inserts or updates a digest cache entry, i.e. a hash (keyed by method) of an image digest or the name of the image it was computed from (keyed by 'name').'''
+        self.__conn.execute('INSERT INTO digest_data (digest, key, value, seq) VALUES (?, ?, ?, ?) '
+                            'ON CONFLICT (digest, key) DO UPDATE SET value = excluded.value, seq = excluded.seq',
+                            (digest, key, value, self.__getWriteSeq()))
+
+    def removeImage(self, name: str):
+        '''Removes all hashes and the text of an image.'''
+        self.__getWriteSeq()
+        self.__conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'removed'")
+        self.__conn.execute('DELETE FROM image_hash WHERE name = ?', (name,))
+        self.__conn.execute('DELETE FROM image_text WHERE name = ?', (name,))
+
+    def getImageHash(self, name: str, method: str) -> str:
+        '''Returns the hash of an image for a hashing method, or None if it isn't stored.'''
+        row = self.__conn.execute('SELECT hash FROM image_hash WHERE name = ? AND method = ?', (name, method)).fetchone()
+        return row[0] if row else None
+
+    def getImageText(self, name: str) -> str:
+        '''Returns the OCR text of an image, or None if it isn't stored.'''
+        row = self.__conn.execute('SELECT text FROM image_text WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else None
+
+    def readImageHashes(self, method: str, since: int = -1) -> dict:
+        '''Returns a dictionary mapping image names to their hashes for a hashing method, in insertion order, optionally only those written after the given generation.'''
+        return dict(self.__conn.execute('SELECT name, hash FROM image_hash WHERE method = ? AND seq > ? ORDER BY rowid', (method, since)))
+
+    def readImageMethodHashes(self, since: int = -1) -> dict:
+        '''Returns a dictionary mapping image names to dictionaries of their hashes keyed by hashing method, in insertion order, optionally only those written after the given generation.'''
+        data = {}
+        for name, method, img_hash in self.__conn.execute('SELECT name, method, hash FROM image_hash WHERE seq > ? ORDER BY rowid', (since,)):
+            if name not in data:
+                data[name] = {}
+            data[name][method] = img_hash
+        return data
+
+    def readImageTexts(self, since: int = -1) -> dict:
+        '''Returns a dictionary mapping image names to their OCR texts, in insertion order, optionally only those written after the given generation.'''
+        return dict(self.__conn.execute('SELECT name, text FROM image_text WHERE seq > ? ORDER BY rowid', (since,)))
+
+    def readDigestData(self, since: int = -1) -> dict:
+        '''Returns a dictionary mapping image digests to dictionaries of their cached hashes (keyed by method) and the name of the image they were computed from (keyed by 'name'), optionally only those written after the given generation.'''
+        data = {}
+        for digest, key, value in self.__conn.execute('SELECT digest, key, value FROM digest_data WHERE seq > ? ORDER BY rowid', (since,)):
+            if digest not in data:
+                data[digest] = {}
+            data[digest][key] = value
+        return data
+
+    def importData(self, x: dict, method: str) -> int:
+        '''
+        Imports the contents of a repost checker JSON cache into the store, and commits it.
+
+        Parameters:
+        - x      : The parsed JSON cache, with its journal applied (as read by RepostChecker when importing it).
+        - method : The image hashing method the hashes in the JSON cache were computed with.
+
+        Returns:
+        The number of images imported.
+        '''
+        for name, img_hash in x.get('image_to_hash', {}).items():
+            self.setImageHash(name, method, img_hash)
+        for name, method_hashes in x.get('image_to_method_hashes', {}).items():
+            for other_method, img_hash in method_hashes.items():
+                self.setImageHash(name, other_method, img_hash)
+        for name, text in x.get('image_to_text', {}).items():
+            self.setImageText(name, text)
+        for digest, data in x.get('digest_to_data', {}).items():
+            for key, value in data.items():
+                self.setDigestData(digest, key, value)
+        self.commit()
+        return len(x.get('image_to_hash', {}))
+
+    def commit(self):
+        '''Commits all changes made since the last commit.'''
+        self.__conn.commit()
+
+    def close(self):
+        '''Commits and closes the store.'''
+        self.__conn.commit()
+        self.__conn.close()
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+
+'''
+Long-running repost check service.
+
+The repost checker's cache is loaded once, and the service then answers whether posted images
+are reposts (and of which loaded images) over HTTP:
+
+    POST /check?img_sim_min=0.8&text_sim_min=0.7&top_k=10   (the body is the raw image file)
+    GET  /health
+
+Concurrent requests are batched, so images of a batch are read by the OCR pool in parallel,
+and only images with any image hash candidates are read at all.
+
+Run python repost_server.py --help for its options, and repost_server_benchmark.py to load test it.
+'''
+
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from PIL import Image, UnidentifiedImageError
+import argparse
+import io
+import json
+import queue
+import threading
+import time
+
+from repost.repost_checker import RepostChecker
+from hasher.hasher import Hasher
+from ocr.ocr import OCR
+from ocr.ocrpool import OCRPool
+
+class RepostService:
+    '''
+    Answers repost queries against a loaded repost checker, in batches.
+
+    Queries are queued by any number of threads, and a single thread takes them off the queue in batches of
+    up to batch_size, so the checker is only ever used by one thread. Queries arriving while a batch is answered
+    make up the next batch, so by default no time is spent waiting for a batch to fill up. The images of a batch which have candidates by image hash are read in parallel by the OCR pool.
+
+    variables that can be modified:
+    - batch_size : The maximum number of queries answered in a batch.
+    - batch_wait : The maximum number of seconds to wait for more queries once one arrives, trading latency for larger batches.
+    '''
+
+    def __init__(self, checker: RepostChecker, ocr_pool: OCRPool = None, batch_size: int = 16, batch_wait: float = 0.0):
+        '''
+        Starts the batching thread.
+
+        Parameters:
+        - checker  : a repost checker with its cache loaded.
+        - ocr_pool : an OCRPool to read image texts with, or None to read them in this process.
+        '''
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.__checker = checker
+        self.__ocrPool = ocr_pool
+        self.__queue = queue.Queue()
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+
+    def submit(self, image_bytes: bytes, img_sim_min: float = 0.8, text_sim_min: float = 0.7, top_k: int = None) -> Future:
+        '''Queues a query for the image file contents given, returning a Future of its result as per check.'''
+        future = Future()
+        self.__queue.put((future, image_bytes, img_sim_min, text_sim_min, top_k))
+        return future
+
+    def check(self, image_bytes: bytes, img_sim_min: float = 0.8, text_sim_min: float = 0.7, top_k: int = None) -> dict:
+        '''
+        Checks whether the image with the given file contents is a repost of any loaded image.
+
+        Returns:
+        A dictionary of whether it's a repost, its hash and the reposts found as per RepostChecker.findReposts.
+        Raises UnidentifiedImageError if the contents aren't an image.
+        '''
+        return self.submit(image_bytes, img_sim_min, text_sim_min, top_k).result()
+
+    def close(self):
+        '''Stops the batching thread once all queued queries are answered.'''
+        self.__queue.put(None)
+        self.__thread.join()
+
+    def __nextBatch(self) -> list:
+        '''blocks until a query arrives, then collects more until the batch is full or batch_wait passes'''
+        item = self.__queue.get()
+        if item is None:
+            return None
+        batch = [item]
+        deadline = time.monotonic() + self.batch_wait
+        while len(batch) < self.batch_size:
+            try:
+                remaining = deadline - time.monotonic()
+                item = self.__queue.get(timeout=remaining) if remaining > 0 else self.__queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self.__queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def __run(self):
+        while True:
+            batch = self.__nextBatch()
+            if batch is None:
+                return
+            try:
+                self.__answer(batch)
+            except Exception as e:
+                for future, *_ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def __answer(self, batch: list):
+        method = self.__checker.getImageHashMethod()
+        queries = []
+        for future, image_bytes, img_sim_min, text_sim_min, top_k in batch:
+            try:
+                img = Image.open(io.BytesIO(image_bytes))
+                img_hash = Hasher.hashImage(img, method)
+            except (UnidentifiedImageError, OSError) as e:
+                future.set_exception(e)
+                continue
+            #texts only matter for images with candidates by image hash, which most images aren't reposts of
+            candidates = self.__checker.findSimilarImages(img_hash, img_sim_min)
+            needs_text = text_sim_min > 0.0 and len(candidates) > 0
+            queries.append((future, img, img_hash, candidates, needs_text, img_sim_min, text_sim_min, top_k))
+
+        to_read = [img for _, img, _, _, needs_text, *_ in queries if needs_text]
+        if self.__ocrPool is not None:
+            texts = iter(self.__ocrPool.map(to_read, normalized=True))
+        else:
+            texts = iter([OCR.read2Normalized(img) for img in to_read])
+
+        for future, img, img_hash, candidates, needs_text, img_sim_min, text_sim_min, top_k in queries:
+            img_text = next(texts) if needs_text else ''
+            reposts = self.__checker.findReposts(img_hash, img_text, img_sim_min, text_sim_min, top_k=top_k, candidates=candidates) \
+                      if needs_text or text_sim_min <= 0.0 else []
+            future.set_result({
+                'isRepost': len(reposts) > 0,
+                'hash': img_hash,
+                'reposts': [{'imgName': a, 'imgDiff': b, 'textSim': c} for a, b, c in reposts]
+            })
+
+class RepostRequestHandler(BaseHTTPRequestHandler):
+    '''HTTP/1.1 handler, so clients can keep their connections alive across queries'''
+    protocol_version = 'HTTP/1.1'
+    #headers and bodies are written separately, which would otherwise be delayed by nagle's algorithm and delayed acks
+    disable_nagle_algorithm = True
+    service = None
+    quiet = True
+
+    def do_GET(self):
+        if urlparse(self.path).path == '/health':
+            self.__respond(200, {'status': 'ok'})
+        else:
+            self.__respond(404, {'error': 'not found'})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+        if url.path != '/check':
+            self.__respond(404, {'error': 'not found'})
+            return
+        try:
+            params = parse_qs(url.query)
+            img_sim_min = float(params.get('img_sim_min', [0.8])[0])
+            text_sim_min = float(params.get('text_sim_min', [0.7])[0])
+            top_k = int(params['top_k'][0]) if 'top_k' in params else None
+        except ValueError as e:
+            self.__respond(400, {'error': str(e)})
+            return
+        try:
+            result = self.service.check(body, img_sim_min, text_sim_min, top_k)
+        except (UnidentifiedImageError, OSError):
+            self.__respond(400, {'error': 'the request body is not an image'})
+        except Exception as e:
+            #e.g. a TesseractError, which mustn't drop the connection without a response
+            self.log_error('check failed: %r', e)
+            self.__respond(500, {'error': '%s: %s' % (type(e).__name__, e)})
+        else:
+            self.__respond(200, result)
+
+    def __respond(self, status: int, obj: dict):
+        data = json.dumps(obj).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        if not self.quiet:
+            super().log_message(format, *args)
+
+    def log_error(self, format, *args):
+        '''errors are logged even when quiet'''
+        super().log_message(format, *args)
+
+def loadChecker(img_dir: str, cache: str = 'json', index_method: str = 'mih') -> RepostChecker:
+    '''loads the repost checker's cache once, and builds its image hash index before any query arrives'''
+    checker = RepostChecker(img_dir)
+    checker.verbose = False
+    checker.update_cache = False
+    checker.index_method = index_method
+    if cache == 'sqlite':
+        checker.setSqliteCacheFilenameTarget()
+    elif cache == 'corpus':
+        checker.setCorpusFilenameTarget()
+    checker.readProcessedDataFromCache()
+    checker.buildImageIndex()
+    return checker
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='serves repost checks of posted images over HTTP')
+    parser.add_argument('--dir', default='scraper_cache', help='the image directory with the repost checker cache')
+    parser.add_argument('--cache', default='json', choices=['json', 'sqlite', 'corpus'], help='the cache format to load')
+    parser.add_argument('--index', default='mih', choices=['mih', 'bktree'], help='the image hash index')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--ocr-workers', type=int, default=0, help='OCR worker processes, 0 for all cpus')
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--batch-wait-ms', type=float, default=0.0)
+    parser.add_argument('--verbose', action='store_true', help='logs every request')
+    args = parser.parse_args()
+
+    print('loading %s...' % args.dir)
+    start = time.perf_counter()
+    checker = loadChecker(args.dir, args.cache, args.index)
+    print('loaded and indexed in %.2fs' % (time.perf_counter() - start))
+    with OCRPool(args.ocr_workers if args.ocr_workers else None) as ocr_pool:
+        service = RepostService(checker, ocr_pool, args.batch_size, args.batch_wait_ms/1000)
+        RepostRequestHandler.service = service
+        RepostRequestHandler.quiet = not args.verbose
+        server = ThreadingHTTPServer((args.host, args.port), RepostRequestHandler)
+        server.daemon_threads = True
+        print('serving on http://%s:%d (ctrl-c to stop)' % (args.host, args.port))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        server.server_close()
+        service.close()
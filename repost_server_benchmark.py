@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+
+'''
+Load generator for repost_server.py.
+
+Posts the images of a directory to a running server from several concurrent clients, each keeping its
+connection alive, and prints the latency percentiles and throughput of the lookups.
+'''
+
+from concurrent.futures import ThreadPoolExecutor
+from os import listdir
+from os.path import isfile, join
+import argparse
+import http.client
+import json
+import time
+
+def runClient(host: str, port: int, images: list, query: str) -> list:
+    '''posts the images in order over a single keep-alive connection, returning the latency of each in seconds'''
+    conn = http.client.HTTPConnection(host, port)
+    latencies = []
+    try:
+        for data in images:
+            start = time.perf_counter()
+            conn.request('POST', '/check?' + query, body=data, headers={'Content-Type': 'application/octet-stream'})
+            response = conn.getresponse()
+            json.loads(response.read())
+            latencies.append(time.perf_counter() - start)
+    finally:
+        conn.close()
+    return latencies
+
+def percentile(values: list, p: float) -> float:
+    '''nearest rank percentile of the sorted values'''
+    return values[min(len(values)-1, max(0, int(round(p/100*len(values)))-1))]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='load tests a running repost_server.py')
+    parser.add_argument('--dir', default='scraper_cache', help='the directory of images to post')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--clients', type=int, default=8, help='the number of concurrent clients')
+    parser.add_argument('--requests', type=int, default=1000, help='the total number of lookups')
+    parser.add_argument('--img-sim-min', type=float, default=0.8)
+    parser.add_argument('--text-sim-min', type=float, default=0.7)
+    args = parser.parse_args()
+
+    files = sorted(f for f in listdir(args.dir) if isfile(join(args.dir, f)) and not f.startswith('.') and not f.startswith('__'))
+    images = []
+    for f in files[:args.requests]:
+        with open(join(args.dir, f), 'rb') as file:
+            images.append(file.read())
+    if not images:
+        raise SystemExit('no images found in ' + args.dir)
+    images = [images[i % len(images)] for i in range(args.requests)]
+    query = 'img_sim_min=%s&text_sim_min=%s' % (args.img_sim_min, args.text_sim_min)
+
+    #warm up the server (e.g. its OCR workers) before measuring
+    runClient(args.host, args.port, images[:args.clients], query)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.clients) as executor:
+        parts = [images[i::args.clients] for i in range(args.clients)]
+        results = list(executor.map(lambda part: runClient(args.host, args.port, part, query), parts))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(x for part in results for x in part)
+    print('%d lookups by %d clients in %.2fs (%.1f lookups/s)' % (len(latencies), args.clients, elapsed, len(latencies)/elapsed))
+    for p in (50, 90, 99, 100):
+        print('p%-3d %8.2f ms' % (p, percentile(latencies, p)*1000))